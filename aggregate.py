@@ -0,0 +1,93 @@
+"""System totals computed from the latest battery snapshots"""
+import time
+
+SNAPSHOT_MAX_AGE = 900 # seconds after which the snapshot of a battery no longer counts for the system
+
+class SystemTotals():
+    """Immutable record of the system values, computed in one pass over the fresh snapshots
+
+    power and powerSetpoint follow the battery convention (positive is
+    charging), powerStored and powerDelivered are the summed charging and
+    discharging powers. The energy counters include batteries whose snapshot
+    expired, with their last known value, so the system counters never go
+    back. strategy is the strategy all fresh batteries agree on, "" when
+    they differ.
+    """
+    __slots__ = ('batteries', 'stateOfCharge', 'power', 'powerStored', 'powerDelivered', 'powerSetpoint',
+        'energyStored', 'energyDelivered', 'strategy')
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            object.__setattr__(self, field, values.get(field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SystemTotals is immutable")
+
+    def __repr__(self):
+        return "SystemTotals(" + ", ".join(field + "=" + repr(getattr(self, field)) for field in self.__slots__) + ")"
+
+class SystemAggregator():
+    """Latest snapshot of every battery, with the time it was read
+
+    A snapshot older than maxAge, or one that was expired because the battery
+    became unreachable, is left out of the system values. Only the energy
+    counters keep using it.
+    """
+    def __init__(self, maxAge=SNAPSHOT_MAX_AGE, clock=time.monotonic):
+        self.maxAge = maxAge
+        self.clock = clock
+        self.snapshots = {}
+        self.times = {}
+
+    def update(self, battery, snapshot):
+        self.snapshots[battery] = snapshot
+        self.times[battery] = self.clock()
+
+    def expire(self, battery):
+        """leave the battery out of the system values until its next snapshot"""
+        if battery in self.times:
+            self.times[battery] = None
+
+    def age(self, battery):
+        """seconds since the snapshot of the battery was read, None when it was expired"""
+        read = self.times.get(battery)
+        return None if read is None else self.clock() - read
+
+    def restore(self, battery, snapshot, age):
+        """put back a persisted snapshot that was read age seconds ago, None when it was expired"""
+        self.snapshots[battery] = snapshot
+        self.times[battery] = None if age is None else self.clock() - age
+
+    def remove(self, battery):
+        self.snapshots.pop(battery, None)
+        self.times.pop(battery, None)
+
+    def fresh(self, batteries=None):
+        """the snapshots that still count, by battery name, of all batteries or of the ones listed"""
+        oldest = self.clock() - self.maxAge
+        return {battery: snapshot for battery, snapshot in self.select(batteries).items()
+            if self.times[battery] is not None and self.times[battery] >= oldest}
+
+    def select(self, batteries):
+        if batteries is None:
+            return self.snapshots
+        return {battery: self.snapshots[battery] for battery in batteries if battery in self.snapshots}
+
+    def totals(self, batteries=None):
+        """the system values of all batteries or of the ones listed (e.g. a site), None when none has a fresh snapshot"""
+        fresh = self.fresh(batteries)
+        if len(fresh) == 0:
+            return None
+        snapshots = self.select(batteries).values()
+        charges = [snapshot.stateOfCharge for snapshot in fresh.values() if snapshot.stateOfCharge is not None]
+        powers = [snapshot.power for snapshot in fresh.values() if snapshot.power is not None]
+        strategies = set(snapshot.strategy for snapshot in fresh.values())
+        return SystemTotals(batteries=len(fresh),
+            stateOfCharge=sum(charges) / len(charges) if len(charges) > 0 else None,
+            power=sum(powers),
+            powerStored=sum(power for power in powers if power > 0),
+            powerDelivered=-sum(power for power in powers if power < 0),
+            powerSetpoint=sum(snapshot.powerSetpoint for snapshot in fresh.values() if snapshot.powerSetpoint is not None),
+            energyStored=sum(snapshot.importWh for snapshot in snapshots if snapshot.importWh is not None),
+            energyDelivered=sum(snapshot.exportWh for snapshot in snapshots if snapshot.exportWh is not None),
+            strategy=strategies.pop() if len(strategies) == 1 else "")
@@ -0,0 +1,132 @@
+"""Distribution of a site setpoint over the batteries"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FULL = 0.99 # state of charge above which a battery is not charged any further
+EMPTY = 0.01 # state of charge below which a battery is not discharged any further
+NUMPY_MIN_BATTERIES = 32 # smaller fleets are faster with plain lists than with numpy arrays
+
+class BatteryAvailability():
+    """What the allocation needs to know of one battery, taken from its latest poll"""
+    __slots__ = ('name', 'stateOfCharge', 'available', 'reason')
+
+    def __init__(self, name, stateOfCharge, available=True, reason=""):
+        self.name = name
+        self.stateOfCharge = stateOfCharge
+        self.available = available and stateOfCharge is not None
+        self.reason = reason if stateOfCharge is not None else reason or "no state of charge"
+
+class Allocation():
+    """Result of an allocation: the setpoint of every battery and what could not be placed"""
+    def __init__(self, requested, setpoints, excluded):
+        self.requested = requested
+        self.setpoints = setpoints # battery name -> setpoint in W, positive is charging
+        self.excluded = excluded # battery name -> reason it was left out
+
+    @property
+    def total(self):
+        return sum(self.setpoints.values())
+
+    def __repr__(self):
+        return "Allocation(" + str(self.requested) + " W -> " + str(self.setpoints) + ", excluded " + str(self.excluded) + ")"
+
+class AllocationEngine():
+    """Divides a requested site power over the batteries
+
+    Charging power goes to the emptiest batteries and discharging power to the
+    fullest, in proportion to their headroom. Every battery that takes part
+    gets at least minPower and at most maxPower; when the request is too
+    small for all of them the batteries with the least headroom sit it out.
+    Batteries that are stale, overridden or at their SoC limit get 0 W.
+    Large fleets are computed on numpy arrays when numpy is installed.
+    """
+    def __init__(self, minPower, maxPower, full=FULL, empty=EMPTY):
+        self.minPower = abs(minPower)
+        self.maxPower = abs(maxPower)
+        self.full = full
+        self.empty = empty
+
+    def allocate(self, total, batteries):
+        """divide total (W, positive is charging) over batteries, a list of BatteryAvailability"""
+        charging = total > 0
+        excluded = {battery.name: battery.reason for battery in batteries if not battery.available}
+        candidates = [battery for battery in batteries if battery.available]
+        headroom = [(1 - battery.stateOfCharge) if charging else battery.stateOfCharge for battery in candidates]
+        limit = 1 - self.full if charging else self.empty
+        for battery, room in zip(candidates, headroom):
+            if room <= limit and total != 0:
+                excluded[battery.name] = "full" if charging else "empty"
+        shares = fill(abs(total), [room if room > limit else 0.0 for room in headroom], self.minPower, self.maxPower)
+        setpoints = dict.fromkeys((battery.name for battery in batteries), 0)
+        for battery, share in zip(candidates, shares):
+            setpoints[battery.name] = int(round(share if charging else -share))
+        return Allocation(total, setpoints, excluded)
+
+def fill(amount, weights, minPower, maxPower):
+    """split amount over weights (0 is left out): minPower each, the rest in proportion to the weights up to maxPower"""
+    if numpy is not None and len(weights) >= NUMPY_MIN_BATTERIES:
+        return list(fillArray(amount, numpy.asarray(weights, dtype=float), minPower, maxPower))
+    return fillList(amount, weights, minPower, maxPower)
+
+def participants(amount, weights, minPower):
+    """number of batteries that take part: as many as can get minPower, the largest weights first"""
+    usable = sum(1 for weight in weights if weight > 0)
+    if minPower <= 0:
+        return usable
+    count = int(amount // minPower)
+    if count == 0 and amount >= minPower / 2:
+        count = 1 # rounding up beats doing nothing
+    return min(usable, count)
+
+def fillArray(amount, weights, minPower, maxPower):
+    shares = numpy.zeros(len(weights))
+    count = participants(amount, weights, minPower)
+    if count == 0:
+        return shares
+    chosen = numpy.argsort(-weights, kind='stable')[:count]
+    amount = max(amount, count * minPower)
+    share = numpy.full(count, float(min(minPower, maxPower)))
+    weight = weights[chosen]
+    room = maxPower - share
+    remaining = min(amount - share.sum(), room.sum())
+    open_ = room > 0
+    # water filling: hand out the rest by weight, batteries that hit maxPower drop out and the rest is shared again
+    while remaining > 1e-9 and open_.any():
+        extra = numpy.where(open_, remaining * weight / weight[open_].sum(), 0.0)
+        capped = open_ & (extra >= room)
+        if not capped.any():
+            share += extra
+            break
+        share[capped] += room[capped]
+        remaining -= room[capped].sum()
+        room[capped] = 0.0
+        open_ &= ~capped
+    shares[chosen] = share
+    return shares
+
+def fillList(amount, weights, minPower, maxPower):
+    shares = [0.0] * len(weights)
+    count = participants(amount, weights, minPower)
+    if count == 0:
+        return shares
+    chosen = sorted(range(len(weights)), key=lambda index: -weights[index])[:count]
+    amount = max(amount, count * minPower)
+    for index in chosen:
+        shares[index] = float(min(minPower, maxPower))
+    room = {index: maxPower - shares[index] for index in chosen if maxPower > shares[index]}
+    remaining = min(amount - sum(shares), sum(room.values()))
+    while remaining > 1e-9 and len(room) > 0:
+        weightSum = sum(weights[index] for index in room)
+        extra = {index: remaining * weights[index] / weightSum for index in room}
+        capped = [index for index in room if extra[index] >= room[index]]
+        if len(capped) == 0:
+            for index in room:
+                shares[index] += extra[index]
+            break
+        for index in capped:
+            given = room.pop(index)
+            shares[index] += given
+            remaining -= given
+    return shares
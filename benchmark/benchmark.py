@@ -0,0 +1,123 @@
+#
+#   Benchmark of the Sessy plugin against simulated devices
+#
+#   Runs the plugin with fakeDomoticz against the simulator and reports the
+#   duration of the callbacks, the number of API requests per poll and the
+#   number of unit writes. Example:
+#
+#       python benchmark/benchmark.py --batteries 10 --latency 0.05 --cycles 50
+#
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fakeDomoticz
+import plugin
+from metrics import metrics
+from simulator import Simulator
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summary(label, durations):
+    return "{:<12} n={:<5} p50={:8.1f} ms  p95={:8.1f} ms  p99={:8.1f} ms  max={:8.1f} ms".format(label, len(durations),
+        percentile(durations, 0.5) * 1000, percentile(durations, 0.95) * 1000, percentile(durations, 0.99) * 1000, max(durations, default=0) * 1000)
+
+class Benchmark():
+    def __init__(self, args):
+        self.args = args
+        self.simulator = Simulator(args.batteries, args.latency, args.jitter, args.error_rate, meters=args.meters)
+        self.heartbeats = []
+        self.commands = []
+        self.requests = []
+        self.writes = []
+
+    def measure(self, callback, *args):
+        """run a plugin callback, returns its duration and the API requests and unit writes it caused"""
+        requests = self.simulator.requests
+        writes = fakeDomoticz.updateCount
+        start = time.perf_counter()
+        callback(*args)
+        return time.perf_counter() - start, self.simulator.requests - requests, fakeDomoticz.updateCount - writes
+
+    def run(self):
+        self.simulator.start()
+        home = tempfile.mkdtemp(prefix="sessy_benchmark_")
+        config = self.simulator.config()
+        config["transport"] = self.args.transport
+        if self.args.metrics:
+            config["metrics"] = {"devices": True}
+        with open(os.path.join(home, "config.json"), "w") as f:
+            json.dump(config, f)
+        os.chdir(home) # the plugin writes its log file in the working directory
+        plugin.Parameters.update({"HomeFolder": home + os.sep, "Mode2": str(self.args.interval), "Mode4": "Normal", "Name": "benchmark"})
+        plugin.Devices.clear()
+        thePlugin = plugin.SessyBatteryPlugin()
+        output = sys.stdout if self.args.verbose else io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                self.startup = self.measure(thePlugin.onStart)
+                totals = (self.simulator.requests, fakeDomoticz.updateCount)
+                for cycle in range(self.args.cycles):
+                    duration, requests, writes = self.measure(thePlugin.onHeartbeat)
+                    self.heartbeats.append(duration)
+                    if requests > 0:
+                        self.requests.append(requests)
+                        self.writes.append(writes)
+                    if self.args.commands and cycle % self.args.commands == self.args.commands - 1:
+                        level = (cycle // self.args.commands % 5 - 2) * 500
+                        self.commands.append(self.measure(thePlugin.onCommand, thePlugin.system_name, thePlugin.batPowerSetpointUnit, "Set Level", level, None)[0])
+                    if self.args.sleep:
+                        time.sleep(self.args.sleep)
+                self.totals = (self.simulator.requests - totals[0], fakeDomoticz.updateCount - totals[1])
+                self.metrics = metrics.report()
+                thePlugin.onStop()
+        finally:
+            self.simulator.stop()
+
+    def report(self):
+        args = self.args
+        lines = ["Sessy plugin benchmark: {} batteries, {} P1 meters, latency {} s (jitter {} s), error rate {}, {} heartbeats, interval {}, {} transport".format(
+            args.batteries, args.meters, args.latency, args.jitter, args.error_rate, args.cycles, args.interval, args.transport)]
+        lines.append("startup      {:8.1f} ms, {} requests, {} unit writes".format(self.startup[0] * 1000, self.startup[1], self.startup[2]))
+        lines.append(summary("heartbeat", self.heartbeats))
+        if len(self.commands) > 0:
+            lines.append(summary("command", self.commands))
+        if len(self.requests) > 0:
+            lines.append("per poll     {:.1f} requests, {:.1f} unit writes (over {} heartbeats that polled)".format(
+                sum(self.requests) / len(self.requests), sum(self.writes) / len(self.writes), len(self.requests)))
+        lines.append("overall      {:.1f} requests, {:.1f} unit writes per heartbeat".format(self.totals[0] / max(1, args.cycles), self.totals[1] / max(1, args.cycles)))
+        if args.metrics:
+            lines.extend(self.metrics)
+        return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Sessy plugin against simulated devices")
+    parser.add_argument("--batteries", type=int, default=4)
+    parser.add_argument("--meters", type=int, default=1, help="number of P1 meters")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean answer delay of the devices in seconds")
+    parser.add_argument("--jitter", type=float, default=0.005, help="standard deviation of the delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with an error")
+    parser.add_argument("--cycles", type=int, default=30, help="number of heartbeats to run")
+    parser.add_argument("--interval", type=int, default=1, help="refresh interval in heartbeats (Mode2)")
+    parser.add_argument("--commands", type=int, default=0, help="send a system setpoint command every N heartbeats")
+    parser.add_argument("--transport", choices=["blocking", "event"], default="blocking", help="transport mode of the plugin")
+    parser.add_argument("--sleep", type=float, default=0.0, help="seconds to wait between heartbeats")
+    parser.add_argument("--verbose", action="store_true", help="show the plugin output")
+    parser.add_argument("--metrics", action="store_true", help="enable the metrics units and show the timing statistics of the plugin")
+    args = parser.parse_args()
+    benchmark = Benchmark(args)
+    benchmark.run()
+    print(benchmark.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#
+#   Sessy simulator - local stand-in for Sessy batteries and the Sessy P1 dongle
+#
+#   Every simulated device listens on its own port of 127.0.0.1 and answers the
+#   API calls used by the plugin with plausible, slowly changing values. The
+#   latency and the share of failing calls can be set to test the plugin under load.
+#
+import json
+import random
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class SimulatedDevice():
+    """State of one simulated Sessy battery or P1 dongle"""
+    def __init__(self, name, kind, latency=0.0, jitter=0.0, errorRate=0.0):
+        self.name = name
+        self.kind = kind
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.stateOfCharge = random.uniform(0.2, 0.8)
+        self.power = 0
+        self.setpoint = 0
+        self.strategy = "POWER_STRATEGY_NOM"
+        self.importWh = random.randint(10000, 20000)
+        self.exportWh = random.randint(10000, 20000)
+        self.gridPower = [random.randint(-700, 700) for phase in range(3)]
+        self.gridEnergy = [random.randint(1000000, 2000000) for counter in range(4)]
+        self.batteries = [] # batteries behind a P1 meter, their power (positive is charging) adds to the grid power
+
+    def delay(self):
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def fails(self):
+        return random.random() < self.errorRate
+
+    def step(self):
+        """let the values drift a little between calls"""
+        with self.lock:
+            self.requests += 1
+            self.power = self.setpoint if self.strategy == "POWER_STRATEGY_API" else int(self.power * 0.8 + random.randint(-300, 300))
+            self.stateOfCharge = min(1.0, max(0.0, self.stateOfCharge + self.power / 5000000))
+            if self.power > 0:
+                self.importWh += 1
+            elif self.power < 0:
+                self.exportWh += 1
+            self.gridPower = [power + random.randint(-70, 70) for power in self.gridPower]
+            self.gridEnergy[0 if sum(self.gridPower) + sum(battery.power for battery in self.batteries) > 0 else 2] += 1
+
+    def get(self, path):
+        if self.kind == "p1meter" and path == "/api/v2/p1/details":
+            batteryPower = sum(battery.power for battery in self.batteries) / 3
+            phases = [round(power + batteryPower) for power in self.gridPower]
+            total = sum(phases)
+            details = {"status": "ok", "state": "P1_OK", "dsmr_version": 50, "tariff_indicator": 1 + int(time.time() // 3600) % 2,
+                "power_total": total, "power_consumed": max(0, total), "power_produced": max(0, -total),
+                "energy_consumed_tariff1": self.gridEnergy[0], "energy_consumed_tariff2": self.gridEnergy[1],
+                "energy_produced_tariff1": self.gridEnergy[2], "energy_produced_tariff2": self.gridEnergy[3]}
+            for phase, power in enumerate(phases, 1):
+                details["power_consumed_l" + str(phase)] = max(0, power)
+                details["power_produced_l" + str(phase)] = max(0, -power)
+                details["voltage_l" + str(phase)] = 230000 + random.randint(-2000, 2000)
+                details["current_l" + str(phase)] = abs(power) * 1000 // 230
+            return details
+        if self.kind != "battery":
+            return None
+        if path == "/api/v1/power/status":
+            phase = {"voltage_rms": 230000 + random.randint(-2000, 2000), "current_rms": abs(self.power) * 1000 // 230, "power": self.power}
+            return {"status": "ok",
+                "sessy": {"state_of_charge": self.stateOfCharge, "power": self.power, "power_setpoint": self.setpoint, "frequency": 50000,
+                    "system_state": "SYSTEM_STATE_RUNNING_SAFE", "strategy_overridden": False},
+                "renewable_energy_phase1": phase, "renewable_energy_phase2": phase, "renewable_energy_phase3": phase}
+        if path == "/api/v1/energy/status":
+            return {"status": "ok", "sessy_energy": {"import_wh": self.importWh, "export_wh": self.exportWh}}
+        if path == "/api/v1/power/active_strategy":
+            return {"status": "ok", "strategy": self.strategy}
+        if path == "/api/v1/dynamic/schedule":
+            hour = int(time.time()) // 3600 * 3600
+            return {"status": "ok",
+                "energy_prices": [{"start_time": hour + i * 3600, "end_time": hour + (i + 1) * 3600, "price": random.randint(5000, 40000)} for i in range(24)],
+                "power_strategy": [{"start_time": hour + i * 3600, "end_time": hour + (i + 1) * 3600, "strategy": "POWER_STRATEGY_ROI"} for i in range(24)]}
+        return None
+
+    def post(self, path, body):
+        if self.kind != "battery":
+            return None
+        with self.lock:
+            if path == "/api/v1/power/setpoint":
+                self.setpoint = int(body.get("setpoint", 0))
+                return {"status": "ok"}
+            if path == "/api/v1/power/active_strategy":
+                self.strategy = body.get("strategy", self.strategy)
+                return {"status": "ok"}
+        return None
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real devices
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, avoid delayed ACK stalls on every answer
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def answer(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_call(self, call):
+        device = self.server.device
+        device.step()
+        device.delay()
+        if device.fails():
+            self.answer(500, {"status": "error", "error": "simulated failure"})
+            return
+        body = call(device)
+        if body is None:
+            self.answer(404, {"status": "error", "error": "unknown API " + self.path})
+        else:
+            self.answer(200, body)
+
+    def do_GET(self):
+        self.handle_call(lambda device: device.get(self.path))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.handle_call(lambda device: device.post(self.path, body))
+
+class Simulator():
+    """A set of simulated devices, each served on its own port"""
+    def __init__(self, batteries=2, latency=0.0, jitter=0.0, errorRate=0.0, host="127.0.0.1", basePort=0, meters=1):
+        self.host = host
+        self.devices = [SimulatedDevice("P1 meter" if meters == 1 else "P1 meter " + str(i + 1), "p1meter", latency, jitter, errorRate) for i in range(meters)]
+        self.devices += [SimulatedDevice("Sessy " + str(i + 1), "battery", latency, jitter, errorRate) for i in range(batteries)]
+        batteryDevices = [device for device in self.devices if device.kind == "battery"]
+        for index, meter in enumerate(self.devices[:meters]):
+            meter.batteries = batteryDevices[index::meters]
+        self.basePort = basePort
+        self.servers = []
+
+    def start(self):
+        for index, device in enumerate(self.devices):
+            server = ThreadingHTTPServer((self.host, self.basePort + index if self.basePort else 0), SimulatorHandler)
+            server.daemon_threads = True
+            server.device = device
+            device.address = self.host + ":" + str(server.server_address[1])
+            threading.Thread(target=server.serve_forever, name="sim-" + device.name, daemon=True).start()
+            self.servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+    @property
+    def requests(self):
+        return sum(device.requests for device in self.devices)
+
+    def config(self):
+        """config.json content pointing the plugin to the simulated devices"""
+        entry = lambda device: {"name": device.name, "ip": device.address, "user": "SIMULATE", "pwd": "SIMULATE"}
+        return {"p1meter": [entry(device) for device in self.devices if device.kind == "p1meter"],
+            "batteries": [entry(device) for device in self.devices if device.kind == "battery"]}
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve simulated Sessy devices on local ports")
+    parser.add_argument("--batteries", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean answer delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="standard deviation of the delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with an error")
+    parser.add_argument("--meters", type=int, default=1, help="number of P1 meters")
+    parser.add_argument("--port", type=int, default=8001, help="port of the first P1 meter, the other devices use the next ones")
+    args = parser.parse_args()
+    simulator = Simulator(args.batteries, args.latency, args.jitter, args.error_rate, basePort=args.port, meters=args.meters).start()
+    print(json.dumps(simulator.config(), indent=4))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
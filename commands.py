@@ -0,0 +1,63 @@
+"""Tracking of commands sent to the Sessy batteries"""
+import time
+
+COMMAND_CONFIRM_POLLS = 3 # polls after which a battery that did not report the commanded value is given up on
+
+class PendingCommand():
+    """A setpoint or strategy sent to one or more batteries
+
+    The requests are dispatched in parallel, the command then waits for the
+    batteries to report the commanded value in their next polls. field is the
+    BatterySnapshot field that should show the expected value.
+    """
+    def __init__(self, description, field, expected):
+        self.description = description
+        self.field = field
+        self.expected = expected # battery name -> commanded value
+        self.futures = {}
+        self.sent = time.monotonic()
+        self.acknowledged = []
+        self.failed = {} # battery name -> reason
+        self.polls = 0
+
+    @property
+    def dispatched(self):
+        """all requests have been answered (or failed)"""
+        return all(future.done() for future in self.futures.values())
+
+    @property
+    def finished(self):
+        return len(self.acknowledged) + len(self.failed) == len(self.expected)
+
+    @property
+    def waiting(self):
+        return [battery for battery in self.expected if battery not in self.acknowledged and battery not in self.failed]
+
+    def collectDispatch(self):
+        """register the batteries whose request failed"""
+        for battery, future in self.futures.items():
+            if battery not in self.failed and future.done() and future.exception() is not None:
+                self.failed[battery] = "request failed: " + str(future.exception())
+
+    def confirm(self, snapshots):
+        """compare the expected values with the latest snapshots, after a poll of the batteries"""
+        self.polls += 1
+        for battery in self.waiting:
+            snapshot = snapshots.get(battery)
+            if snapshot is not None and matches(self.expected[battery], getattr(snapshot, self.field)):
+                self.acknowledged.append(battery)
+            elif self.polls >= COMMAND_CONFIRM_POLLS:
+                self.failed[battery] = "reports " + str(None if snapshot is None else getattr(snapshot, self.field))
+
+    def report(self):
+        text = self.description + " acknowledged by " + (", ".join(self.acknowledged) or "none")
+        if len(self.failed) > 0:
+            text += ", not confirmed by " + ", ".join(battery + " (" + reason + ")" for battery, reason in self.failed.items())
+        return text + " after " + str(round(time.monotonic() - self.sent, 1)) + " s"
+
+def matches(expected, reported):
+    if reported is None:
+        return False
+    if isinstance(expected, (int, float)) and isinstance(reported, (int, float)):
+        return abs(expected - reported) < 1
+    return str(expected).upper() == str(reported).upper()
@@ -0,0 +1,85 @@
+"""Watching config.json for changes while the plugin runs"""
+import hashlib
+import json
+import os
+
+DEVICE_SECTIONS = ("p1meter", "batteries", "sites") # the sections that are applied without a restart
+DEVICE_KEYS = ("ip", "user", "pwd") # settings every battery and P1 meter needs besides its name
+
+class ConfigWatcher():
+    """Detects changes of the configuration file with a cheap check on every heartbeat
+
+    A heartbeat only compares the modification time and size of the file.
+    When they changed the file is read and hashed, so saving it without
+    changes does not count as a change. A file that can not be parsed is
+    reported once, the next save is read again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.digest = None
+
+    def stat(self):
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def read(self):
+        self.stamp = self.stat()
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        changed = digest != self.digest
+        self.digest = digest
+        return content, changed
+
+    def load(self):
+        """read the configuration, raises OSError or json.JSONDecodeError"""
+        return json.loads(self.read()[0])
+
+    def changed(self):
+        """the new configuration when the file changed since it was last read, otherwise None"""
+        stamp = self.stat()
+        if stamp is None or stamp == self.stamp:
+            return None
+        content, changed = self.read()
+        if not changed:
+            return None
+        return json.loads(content)
+
+def deviceProblem(device):
+    """what is wrong with the configuration of a battery or P1 meter, None when it can be set up"""
+    if not isinstance(device, dict):
+        return "a device has to be an object"
+    if not isinstance(device.get("name"), (str, int)) or isinstance(device.get("name"), bool):
+        return "'name' is missing or not a text"
+    for key in DEVICE_KEYS:
+        if not isinstance(device.get(key), str):
+            return "'" + key + "' is missing or not a text"
+    numbers = [("timeout", device.get("timeout", 1)), ("pool_size", device.get("pool_size", 1))]
+    for key in ("timeouts", "max_ages"):
+        if not isinstance(device.get(key, {}), dict):
+            return "'" + key + "' has to be an object with a number per api"
+        numbers += [(key + " " + api, value) for api, value in device.get(key, {}).items()]
+    for key, value in numbers:
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+            return "'" + key + "' has to be a positive number"
+    return None
+
+def devicesByName(devices):
+    """the device configurations of a section by device name"""
+    return {str(device["name"]): device for device in devices}
+
+def diffDevices(old, new):
+    """names of the devices that were added, removed or changed (any setting) between two {name: config}"""
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    changed = [name for name in new if name in old and new[name] != old[name]]
+    return added, removed, changed
+
+def changedSections(old, new):
+    """the other sections of the configuration that differ, these take effect after a restart"""
+    sections = (set(old) | set(new)) - set(DEVICE_SECTIONS)
+    return sorted(section for section in sections if old.get(section) != new.get(section))
@@ -0,0 +1,54 @@
+"""Local zero-on-the-meter control of the battery setpoints"""
+import time
+
+DEADBAND = 25 # W of grid power around the target that is left alone
+KP = 0.3 # proportional gain, W setpoint per W grid power
+KI = 0.05 # integral gain, W setpoint per W grid power per second
+RATE_LIMIT = 200 # W per second the site setpoint may move
+MIN_CHANGE = 50 # W a battery setpoint has to move before it is sent
+
+class NomController():
+    """PI controller moving the site setpoint until the grid power reaches the target
+
+    A positive setpoint charges the batteries, a positive grid power is taken
+    from the grid, so grid import lowers the setpoint. The velocity form is
+    used: every step changes the previous setpoint, which is clamped to the
+    site limits so the integral cannot wind up. Errors within the deadband
+    count as zero and the change per step is limited by the rate limit.
+    """
+    def __init__(self, target=0, deadband=DEADBAND, kp=KP, ki=KI, rateLimit=RATE_LIMIT, clock=time.monotonic):
+        self.target = target
+        self.deadband = deadband
+        self.kp = kp
+        self.ki = ki
+        self.rateLimit = rateLimit
+        self.clock = clock
+        self.setpoint = 0.0
+        self.lastError = None
+        self.lastTime = None
+
+    def reset(self, setpoint=0.0):
+        """start over from the setpoint the batteries have now"""
+        self.setpoint = float(setpoint)
+        self.lastError = None
+        self.lastTime = None
+
+    def update(self, gridPower, minimum, maximum):
+        """new site setpoint (W) for the measured grid power, within minimum and maximum"""
+        now = self.clock()
+        error = gridPower - self.target
+        if abs(error) <= self.deadband:
+            error = 0.0
+        if self.lastTime is None:
+            # first sample: only the proportional step, there is no time base for the integral yet
+            change = -self.kp * error
+            elapsed = 1.0
+        else:
+            elapsed = max(0.001, now - self.lastTime)
+            change = -self.kp * (error - self.lastError) - self.ki * elapsed * error
+        limit = self.rateLimit * elapsed
+        change = max(-limit, min(limit, change))
+        self.setpoint = max(minimum, min(maximum, self.setpoint + change))
+        self.lastError = error
+        self.lastTime = now
+        return self.setpoint
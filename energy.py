@@ -0,0 +1,44 @@
+"""Energy counters computed from power readings"""
+import time
+
+CHECKPOINT_INTERVAL = 300 # seconds between saving the counters in the plugin configuration
+MAX_GAP = 3600 # readings further apart than this are not integrated, the power in between is unknown
+
+class EnergyIntegrator():
+    """Integrates power (W) over time into an energy counter (Wh)
+
+    The counter is kept as a float in memory and integrated with the trapezoid
+    rule on a monotonic clock, so it does not depend on the resolution of the
+    Domoticz LastUpdate timestamp. checkpoint() and restore() carry the state
+    over a restart of the plugin.
+    """
+    def __init__(self, energy=0.0, clock=time.monotonic):
+        self.energy = float(energy)
+        self.clock = clock
+        self.lastPower = None
+        self.lastTime = None
+
+    def update(self, power):
+        """add the energy since the previous reading, returns the counter in Wh"""
+        now = self.clock()
+        if self.lastTime is not None and now - self.lastTime <= MAX_GAP:
+            self.energy += (self.lastPower + power) / 2 * (now - self.lastTime) / 3600
+        self.lastPower = power
+        self.lastTime = now
+        return self.energy
+
+    def checkpoint(self):
+        """state to persist, with wall clock time since the monotonic clock does not survive a restart"""
+        state = {"energy": self.energy}
+        if self.lastTime is not None:
+            state["power"] = self.lastPower
+            state["time"] = time.time() - (self.clock() - self.lastTime)
+        return state
+
+    def restore(self, state):
+        self.energy = float(state.get("energy", 0.0))
+        if "time" in state and "power" in state:
+            age = time.time() - state["time"]
+            if 0 <= age <= MAX_GAP:
+                self.lastPower = state["power"]
+                self.lastTime = self.clock() - age
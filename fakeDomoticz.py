@@ -9,6 +9,7 @@
 #
 from datetime import datetime
 Devices = dict()
+updateCount = 0 # number of Update() calls on units, used by the benchmark
 Parameters = {"Mode1": 200, "Mode2": 6, "Mode3" : 2200, "Mode4": "Debug", "Mode5": "", "Mode6": "Debug", "Port": 8443, "Username": "mail@domain.com" , "Password": "aNicerp@ssword", "Version" : "0.0.0", "HomeFolder":"/home/pi/domoticz/plugins/SessyBattery/", "Name": "fakeDomoticz"}
 config = dict()
 
@@ -22,14 +23,29 @@ class myUnit:
         self.Switchtype=Switchtype
         self.DeviceID=DeviceID
         self.Used=Used
+        self.Options=Options
+        self.nValue=0
+        self.sValue=""
 
     def Create(self):
         print("Creating unit "+str(self.Name)+" for deviceID "+str(self.DeviceID))
+        if self.DeviceID not in Devices:
+            Devices[self.DeviceID] = myDevice(self.DeviceID)
+        Devices[self.DeviceID].Units[self.Unit] = self
+
+    def Update(self):
+        global updateCount
+        updateCount += 1
 
     @property
     def LastUpdate(self):
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
+class myDevice:
+    def __init__(self, DeviceID):
+        self.DeviceID=DeviceID
+        self.Units=dict()
+
 class Domoticz:
     def __init__(self):
         self.Units = []
@@ -64,5 +80,8 @@ class Domoticz:
         self.Units.append(newUnit)
         return newUnit
 
-    def Configuration(self):
+    def Configuration(self, Config=None):
+        global config
+        if Config is not None:
+            config = Config
         return config
@@ -0,0 +1,97 @@
+"""Grid readings of one or more P1 meters"""
+import time
+
+PHASES = (1, 2, 3)
+# summed over the meters of a site, the voltages are averaged instead
+SUMMED_FIELDS = ('power_total', 'power_consumed', 'power_produced',
+    'power_consumed_l1', 'power_consumed_l2', 'power_consumed_l3', 'power_produced_l1', 'power_produced_l2', 'power_produced_l3',
+    'energy_consumed_tariff1', 'energy_consumed_tariff2', 'energy_produced_tariff1', 'energy_produced_tariff2')
+VOLTAGE_FIELDS = ('voltage_l1', 'voltage_l2', 'voltage_l3')
+
+def number(data, field):
+    value = data.get(field)
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def phasePower(data, phase):
+    """net power (W) taken from the grid on one phase, negative when feeding in, None when not reported"""
+    consumed = number(data, "power_consumed_l" + str(phase))
+    produced = number(data, "power_produced_l" + str(phase))
+    if consumed is None and produced is None:
+        return None
+    return (consumed or 0) - (produced or 0)
+
+def phaseCurrent(data, phase):
+    """current (mA) on one phase, signed like phasePower since the meter only reports its magnitude"""
+    current = number(data, "current_l" + str(phase))
+    if current is None:
+        return None
+    power = phasePower(data, phase)
+    return -abs(current) if power is not None and power < 0 else abs(current)
+
+class SiteGrid():
+    """Latest reading of every P1 meter of a site and the site level sum
+
+    Powers, energy counters and the signed phase currents of the meters are
+    added per phase, the voltages are averaged over the meters reporting
+    them. A meter that has not answered yet is left out of the sum.
+    """
+    def __init__(self, meters):
+        self.readings = dict.fromkeys(meters)
+        self.times = dict.fromkeys(meters)
+
+    def add(self, meter):
+        self.readings.setdefault(meter, None)
+        self.times.setdefault(meter, None)
+
+    def remove(self, meter):
+        self.readings.pop(meter, None)
+        self.times.pop(meter, None)
+
+    def update(self, meter, data, timestamp=None):
+        self.readings[meter] = data
+        self.times[meter] = time.monotonic() if timestamp is None else timestamp
+
+    @property
+    def complete(self):
+        """every meter has answered at least once"""
+        return all(reading is not None for reading in self.readings.values())
+
+    def age(self, now=None):
+        """seconds since the oldest of the latest readings, None before all meters answered"""
+        if not self.complete:
+            return None
+        return (time.monotonic() if now is None else now) - min(self.times.values())
+
+    def aggregate(self):
+        """the readings combined into one answer in the format of the P1 details API, None without readings"""
+        readings = [reading for reading in self.readings.values() if reading is not None]
+        if len(readings) == 0:
+            return None
+        if len(readings) == 1:
+            return readings[0]
+        site = {"status": "ok"}
+        for field in SUMMED_FIELDS:
+            values = [number(reading, field) for reading in readings]
+            values = [value for value in values if value is not None]
+            if len(values) > 0:
+                site[field] = sum(values)
+        for field in VOLTAGE_FIELDS:
+            values = [number(reading, field) for reading in readings]
+            values = [value for value in values if value is not None]
+            if len(values) > 0:
+                site[field] = sum(values) / len(values)
+        for phase in PHASES:
+            currents = [phaseCurrent(reading, phase) for reading in readings]
+            currents = [current for current in currents if current is not None]
+            if len(currents) > 0:
+                site["current_l" + str(phase)] = sum(currents)
+        tariffs = [reading["tariff_indicator"] for reading in readings if "tariff_indicator" in reading]
+        if len(tariffs) > 0:
+            site["tariff_indicator"] = tariffs[0]
+        return site
+
+    @property
+    def power(self):
+        """net site power (W) taken from the grid, None without readings"""
+        site = self.aggregate()
+        return None if site is None else number(site, "power_total")
@@ -0,0 +1,82 @@
+"""Timing of the plugin hot paths"""
+import threading
+import time
+from collections import deque
+
+WINDOW = 500 # number of most recent samples kept per histogram
+
+class RollingHistogram():
+    """Durations (seconds) of the last WINDOW samples of one measurement"""
+    def __init__(self, window=WINDOW):
+        self.samples = deque(maxlen=window)
+        self.total = 0
+
+    def add(self, duration):
+        self.samples.append(duration)
+        self.total += 1
+
+    def percentile(self, fraction):
+        if len(self.samples) == 0:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    def summary(self):
+        """p50, p95 and max in seconds"""
+        return self.percentile(0.5), self.percentile(0.95), max(self.samples, default=0.0)
+
+class Metrics():
+    """Rolling histograms by name, safe to record from the worker threads"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def record(self, name, duration):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = RollingHistogram()
+            histogram.add(duration)
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def get(self, name):
+        with self.lock:
+            return self.histograms.get(name)
+
+    def names(self, prefix=""):
+        with self.lock:
+            return [name for name in self.histograms if name.startswith(prefix)]
+
+    def slowest(self, prefix=""):
+        """name and summary of the measurement with the highest p95"""
+        with self.lock:
+            candidates = [(name, histogram.summary()) for name, histogram in self.histograms.items() if name.startswith(prefix)]
+        return max(candidates, key=lambda candidate: candidate[1][1], default=None)
+
+    def report(self):
+        """one line per measurement, for the log"""
+        with self.lock:
+            items = sorted(self.histograms.items())
+            lines = []
+            for name, histogram in items:
+                p50, p95, highest = histogram.summary()
+                lines.append("{}: n={} p50={:.1f} ms p95={:.1f} ms max={:.1f} ms".format(name, histogram.total, p50 * 1000, p95 * 1000, highest * 1000))
+        return lines
+
+class Timer():
+    """Context manager adding the duration of its block to a histogram"""
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+metrics = Metrics()
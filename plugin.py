@@ -56,14 +56,106 @@ except ImportError:
     debug = True
 import logging
 import json
+import os
 import time
+import functools
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+try:
+    import orjson # optional, considerably faster json decoding
+    jsonLoads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        jsonLoads = ujson.loads
+    except ImportError:
+        jsonLoads = json.loads
 import exceptions
+from polling import DeviceHealth, AdaptiveInterval, PollPlan, HEARTBEAT_SECONDS
+from snapshot import BatterySnapshot
+from schedule import ScheduleCache
+from commands import PendingCommand
+from energy import EnergyIntegrator, CHECKPOINT_INTERVAL
+from transport import EventTransport
+from metrics import metrics
+from grid import phasePower, phaseCurrent
+from control import NomController, DEADBAND, KP, KI, RATE_LIMIT, MIN_CHANGE
+from allocation import AllocationEngine, BatteryAvailability
+from aggregate import SystemAggregator, SystemTotals, SNAPSHOT_MAX_AGE
+from units import UnitSpec, customSpec, scaled, state
+from configwatch import ConfigWatcher, deviceProblem, devicesByName, diffDevices, changedSections
+from sites import Site, siteConfigs, SYSTEM_NAME, P1_NAME
+from recorder import TelemetryRecorder, BATTERY_FIELDS, P1_FIELDS, DEFAULT_CAPACITY
+
+MAX_POLL_WORKERS = 8 # upper bound of parallel requests to the Sessy devices
+DEFAULT_TIMEOUT = 6 # seconds to wait for a Sessy device to answer
+DEFAULT_POOL_SIZE = 2 # number of keep-alive connections per Sessy device
+
+# value formatting of the units in the unit spec tables
+def percentageValue(stateOfCharge):
+    #battery state of charge. Percentage with high number of decimals, needs to be trimmed
+    perc = round(stateOfCharge*100,1)
+    return int(perc), str(perc)
+
+def setpointValue(setpoint):
+    return int(setpoint), str(setpoint)
+
+def strategyValue(strategy):
+    powerStrat = PowerStrategy(str(strategy or ""))
+    if powerStrat.state is None:
+        powerStrat.state = 7 # a strategy this plugin does not know is shown as mixed
+    return powerStrat.state, str(powerStrat.state*10)
+
+def switchValue(on):
+    switch = SwitchMode(str(on))
+    return switch.state, str(switch)
+
+def batteryPowers(power):
+    """consumed and produced power of a battery, domoticz wants the battery power the other way around"""
+    power = round(power,1) * -1
+    consPower = abs(power) if power < 0 else 0 # negative power is going into battery
+    prodPower = abs(power) if power > 0 else 0 # positive power is going out of battery
+    return consPower, prodPower
 
-P1_FACTOR = 10 # number of battery polls before polling P1
+def deliveredValue(power, exportWh):
+    return 0, str(batteryPowers(power)[1])+";"+str(exportWh)
+
+def storedValue(power, importWh):
+    return 0, str(batteryPowers(power)[0])+";"+str(importWh)
+
+def meterValue(USAGE1, RETURN1, CONS, PROD, USAGE2 = 0, RETURN2 = 0):
+    """sValue of a 'P1 Smart Meter' unit"""
+    return 0, str(USAGE1)+";"+str(USAGE2)+";"+str(RETURN1)+";"+str(RETURN2)+";"+str(CONS)+";"+str(PROD)
+
+def batteryMeterValue(power, importWh, exportWh):
+    consPower, prodPower = batteryPowers(power)
+    return meterValue(importWh, exportWh, consPower, prodPower)
+
+def systemMeterValue(energyStored, energyDelivered, powerStored, powerDelivered):
+    return meterValue(energyStored, energyDelivered, round(powerStored, 1), round(powerDelivered, 1))
+
+def gridMeterValue(data):
+    return meterValue(data["energy_consumed_tariff1"], data["energy_produced_tariff1"], data.get("power_consumed", 0), data.get("power_produced", 0),
+        data.get("energy_consumed_tariff2", 0), data.get("energy_produced_tariff2", 0))
+
+def gridCounters(data):
+    """the P1 details when they hold the energy counters"""
+    return data if "energy_consumed_tariff1" in data and "energy_produced_tariff1" in data else None
 dt_format = "%Y-%m-%d %H:%M:%S"
 
+def bufferedUpdates(callback):
+    """decorator for plugin callbacks: the unit updates done in the callback are written once it has finished,
+    the duration of the callback including the writes is added to the metrics"""
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        with metrics.timer(callback.__name__), updateBuffer:
+            return callback(*args, **kwargs)
+    return wrapper
+
 class SessyBatteryPlugin:
     #define class variables
     enabled = False
@@ -121,27 +213,108 @@ class SessyBatteryPlugin:
     batErrorWarning = 25
     # 24: sensor type 'switch', 
     batStrategyOverridden = 26
+    # 27: sensor type 'Custom Sensor', 'Poll interval' of the system
+    batPollIntervalUnit = 27
+    # 28: sensor type 'Custom Sensor', 'Energy price' of the current quarter hour
+    batEnergyPriceUnit = 28
+    # 29: sensor type 'Text', 'Cheapest upcoming price' from the dynamic schedule
+    batCheapestPriceUnit = 29
+    # 30: sensor type 'Custom Sensor', 'Heartbeat duration' p95 (optional metrics)
+    batHeartbeatTimeUnit = 30
+    # 31: sensor type 'Custom Sensor', 'API latency' p95 over all devices (optional metrics)
+    batApiLatencyUnit = 31
+    # 32: sensor type 'Text', 'Slowest API' (optional metrics)
+    batSlowestApiUnit = 32
+    # 33: sensor type 'Push On' button, 'Dump statistics' to the log (optional metrics)
+    batDumpStatsUnit = 33
+    # 34: sensor type 'P1 Smart Meter', 'Grid power' of a P1 meter or the site
+    # P1 devices use units 8-16 for the voltage, current and power of their phases
+    p1GridUnit = 34
+    # 35: sensor type 'Switch', 'Local NoM control' on the system device (optional control loop)
+    batControlUnit = 35
+    # 36: sensor type 'Custom Sensor', 'Heartbeat duration p50' (optional metrics)
+    batHeartbeatMedianUnit = 36
+    # 37: sensor type 'Custom Sensor', 'Heartbeat duration max' (optional metrics)
+    batHeartbeatMaxUnit = 37
+    # 38: sensor type 'Custom Sensor', 'P1 poll interval' of the system
+    batP1IntervalUnit = 38
+
+    # the units of each kind of device, created in one pass by createUnits
+    strategyOptions = {"LevelActions" : "|||||",
+        "LevelNames" : "|NoM|Dynamic|Open API|Off|Sessy Connect|Eco|Mixed/unknown",
+        "LevelOffHidden" : "true",
+        "SelectorStyle" : "1"}
+    # the sources of the battery units are BatterySnapshot fields, of the system units SystemTotals fields
+    # and of the P1 units the keys of the P1 details answer
+    batteryUnits = (
+        UnitSpec(batPercentageUnit, 'Battery percentage', "stateOfCharge", percentageValue, TypeName="General", Subtype=6, Used=1),
+        UnitSpec(batEnergyDeliveredUnit, 'Battery delivered power', ("power", "exportWh"), deliveredValue, Type=243, Subtype=29, Switchtype=4, Used=1),
+        UnitSpec(batEnergyStoredUnit, 'Battery stored power', ("power", "importWh"), storedValue, Type=243, Subtype=29),
+        UnitSpec(batBatteryGeneralStateUnit, 'Battery general state', "systemState", state, TypeName="General", Subtype=19),
+        UnitSpec(batBatteryDetailedStateUnit, 'Battery detailed state', "systemStateDetails", state, TypeName="General", Subtype=19),
+        UnitSpec(batPowerUnit, 'Battery in/output power', ("power", "importWh", "exportWh"), batteryMeterValue, Type=250, Subtype=1),
+        UnitSpec(batPhase1VoltageUnit, 'Battery voltage L1', "phase1Voltage", scaled(1000, 0), Type=243, Subtype=8),
+        UnitSpec(batPhase1CurrentUnit, 'Battery current L1', "phase1Current", scaled(1000, 1), Type=243, Subtype=23),
+        UnitSpec(batPhase2VoltageUnit, 'Battery voltage L2', "phase2Voltage", scaled(1000, 0), Type=243, Subtype=8),
+        UnitSpec(batPhase2CurrentUnit, 'Battery current L2', "phase2Current", scaled(1000, 1), Type=243, Subtype=23),
+        UnitSpec(batPhase3VoltageUnit, 'Battery voltage L3', "phase3Voltage", scaled(1000, 0), Type=243, Subtype=8),
+        UnitSpec(batPhase3CurrentUnit, 'Battery current L3', "phase3Current", scaled(1000, 1), Type=243, Subtype=23),
+        UnitSpec(batStrategyUnit, 'Power strategy', "strategy", strategyValue, options=strategyOptions, TypeName="Selector Switch"),
+        UnitSpec(batPowerSetpointUnit, 'Battery power setpoint', "powerSetpoint", setpointValue, Type=242, Subtype=1,
+            options=lambda plugin, deviceId: {'ValueStep':'100', 'ValueMin':str(-1 * plugin.maxPower), 'ValueMax':str(plugin.maxPower), 'ValueUnit':'W'}),
+        UnitSpec(batErrorWarning, 'Battery error/warning', TypeName="Text", Image=7),
+        UnitSpec(batStrategyOverridden, 'Battery strategy overridden', "strategyOverridden", switchValue, TypeName="Switch"),
+        UnitSpec(batEnergyUnit, 'Battery energy', Type=243, Subtype=29),
+    )
+    systemUnits = (
+        UnitSpec(batPercentageUnit, 'Battery percentage', "stateOfCharge", percentageValue, TypeName="General", Subtype=6, Used=1),
+        UnitSpec(batEnergyUnit, 'Battery energy', Type=243, Subtype=29, Used=1),
+        UnitSpec(batPowerUnit, 'Battery in/output power', ("energyStored", "energyDelivered", "powerStored", "powerDelivered"), systemMeterValue, Type=250, Subtype=1, Used=1),
+        UnitSpec(batStrategyUnit, 'Power strategy', "strategy", strategyValue, options=strategyOptions, TypeName="Selector Switch"),
+        UnitSpec(batPowerSetpointUnit, 'Battery power setpoint', "powerSetpoint", setpointValue, Type=242, Subtype=1,
+            options=lambda plugin, deviceId: {'ValueStep':'100', 'ValueMin':str(-1 * plugin.maxPower * len(plugin.sites[deviceId].batteries)), 'ValueMax':str(plugin.maxPower * len(plugin.sites[deviceId].batteries)), 'ValueUnit':'W'}),
+        UnitSpec(batPollIntervalUnit, 'Poll interval', options={'Custom': '1;s'}, TypeName="Custom"),
+        UnitSpec(batP1IntervalUnit, 'P1 poll interval', options={'Custom': '1;s'}, TypeName="Custom"),
+        UnitSpec(batEnergyPriceUnit, 'Energy price', options={'Custom': '1;EUR/kWh'}, TypeName="Custom"),
+        UnitSpec(batCheapestPriceUnit, 'Cheapest upcoming price', TypeName="Text"),
+        UnitSpec(batHeartbeatTimeUnit, 'Heartbeat duration', options={'Custom': '1;ms'}, enabled="metricsUnits", TypeName="Custom"),
+        UnitSpec(batHeartbeatMedianUnit, 'Heartbeat duration p50', options={'Custom': '1;ms'}, enabled="metricsUnits", TypeName="Custom"),
+        UnitSpec(batHeartbeatMaxUnit, 'Heartbeat duration max', options={'Custom': '1;ms'}, enabled="metricsUnits", TypeName="Custom"),
+        UnitSpec(batApiLatencyUnit, 'API latency', options={'Custom': '1;ms'}, enabled="metricsUnits", TypeName="Custom"),
+        UnitSpec(batSlowestApiUnit, 'Slowest API', enabled="metricsUnits", TypeName="Text"),
+        UnitSpec(batDumpStatsUnit, 'Dump statistics', enabled="metricsUnits", Type=244, Subtype=73, Switchtype=9),
+        UnitSpec(batControlUnit, 'Local NoM control', enabled="controlEnabled", TypeName="Switch", Used=1),
+    )
+    p1Units = (
+        #1 is low tarif, 2 is high tarif
+        UnitSpec(p1TarifUnit, 'Tarif', "tariff_indicator", state, TypeName="General", Subtype=19, Used=1),
+        UnitSpec(p1GridUnit, 'Grid power', gridCounters, gridMeterValue, Type=250, Subtype=1, Used=1),
+        UnitSpec(batPhase1VoltageUnit, 'Voltage L1', "voltage_l1", scaled(1000, 1), Type=243, Subtype=8),
+        UnitSpec(batPhase1CurrentUnit, 'Current L1', lambda data: phaseCurrent(data, 1), scaled(1000, 1), Type=243, Subtype=23),
+        UnitSpec(batPhase1PowerUnit, 'Power L1', lambda data: phasePower(data, 1), Type=248, Subtype=1),
+        UnitSpec(batPhase2VoltageUnit, 'Voltage L2', "voltage_l2", scaled(1000, 1), Type=243, Subtype=8),
+        UnitSpec(batPhase2CurrentUnit, 'Current L2', lambda data: phaseCurrent(data, 2), scaled(1000, 1), Type=243, Subtype=23),
+        UnitSpec(batPhase2PowerUnit, 'Power L2', lambda data: phasePower(data, 2), Type=248, Subtype=1),
+        UnitSpec(batPhase3VoltageUnit, 'Voltage L3', "voltage_l3", scaled(1000, 1), Type=243, Subtype=8),
+        UnitSpec(batPhase3CurrentUnit, 'Current L3', lambda data: phaseCurrent(data, 3), scaled(1000, 1), Type=243, Subtype=23),
+        UnitSpec(batPhase3PowerUnit, 'Power L3', lambda data: phasePower(data, 3), Type=248, Subtype=1),
+    )
 
     runCounter = 6
-    p1Counter = P1_FACTOR
-    system_name  = "Sessy system"
+    p1Counter = 1
+    # the system and P1 device of a configuration without sites, each site has its own (see sites.py)
+    system_name  = SYSTEM_NAME
+    p1_name = P1_NAME
     
+    @bufferedUpdates
     def onStart(self):
         self.log_filename = "sessy_"+Parameters["Name"]+".log"
         Domoticz.Log('Plugin starting new version')
         #read out parameters for local connection
-        self.runCounter = int(Parameters['Mode2'])
         self.log_level = Parameters['Mode4']
-        self.systemPercent = 0
-        self.systemPower = 0
-        self.systemPowerDelivered = 0
-        self.systemPowerStored = 0
-        self.systemEnergyDelivered = 0
-        self.systemEnergyStored = 0
-        self.powerStrat = 0
-        self.powerSetpoint = 0
         self.minPower = int(Parameters['Mode1'])
         self.maxPower = int(Parameters['Mode3'])
+        self.allocationEngine = AllocationEngine(self.minPower, self.maxPower)
 
         logging.basicConfig(format='%(asctime)s - %(levelname)-8s - %(filename)-18s - %(message)s', filename=self.log_filename,level=logging.INFO)
         if self.log_level == 'Debug':
@@ -156,370 +329,1051 @@ class SessyBatteryPlugin:
             #logging.basicConfig(format='%(asctime)s - %(levelname)-8s - %(filename)-18s - %(message)s', filename=self.log_filename,level=logging.DEBUG)
             logging.basicConfig(level=logging.DEBUG)
 
+        global debugLogging
+        debugLogging = self.log_level in ('Debug', 'Verbose')
+
         Domoticz.Log("starting plugin version "+Parameters["Version"])
         logging.info("starting plugin version "+Parameters["Version"])
         #Domoticz.Heartbeat(10)
         
-        #read config parameters from disk
+        #read config parameters from disk, changes to the devices are picked up while running (see checkConfig)
         source_path = Parameters['HomeFolder']
-        config_file = source_path + 'config.json'
-        config_map = ""
-        with open(config_file) as f:
-            try:
-                config_map = json.load(f)
-            except json.decoder.JSONDecodeError as theError:
-                Domoticz.Error("JSON error in config file. Error: '" + str(theError.msg) + "' at position: line " + str(theError.lineno) + " column "+ str(theError.colno))
-                logging.error("JSON error in config file. Error: '" + str(theError.msg) + "' at position: line " + str(theError.lineno) + " column "+ str(theError.colno))
-                return
+        self.configWatcher = ConfigWatcher(source_path + 'config.json')
+        try:
+            config_map = self.configWatcher.load()
+        except json.decoder.JSONDecodeError as theError:
+            Domoticz.Error("JSON error in config file. Error: '" + str(theError.msg) + "' at position: line " + str(theError.lineno) + " column "+ str(theError.colno))
+            logging.error("JSON error in config file. Error: '" + str(theError.msg) + "' at position: line " + str(theError.lineno) + " column "+ str(theError.colno))
+            return
         logging.debug("config map = "+ str(config_map))
+        self.config_map = config_map
         
-        # create the p1 meter first
-        self.createP1Units("Sessy P1")
-        self.p1unit = SessyP1(config_map["p1meter"][0])
-        p1data = self.p1unit.getDetails()
-        logging.debug("P1 meter details: " + str(p1data))
-        Domoticz.Log("connected to P1 meter '" + self.p1unit.name + "', status is '"+ p1data["status"] + "'")
-        logging.debug("connected to P1 meter '" + self.p1unit.name + "', status is '"+ p1data["status"] + "'")
-        self.updateP1Units("Sessy P1", p1data)
+        # poll intervals in heartbeats, adapted to how much is going on
+        pollConfig = config_map.get("polling", {})
+        nominal = int(Parameters['Mode2'])
+        adaptive = pollConfig.get("adaptive", True)
+        # by default activity can at most halve the refresh interval, a shorter one has to be configured
+        minimum = int(pollConfig.get("min_interval", nominal // 2 * HEARTBEAT_SECONDS)) // HEARTBEAT_SECONDS
+        maximum = int(pollConfig.get("max_interval", 5 * nominal * HEARTBEAT_SECONDS)) // HEARTBEAT_SECONDS
+        self.batteryInterval = AdaptiveInterval(nominal, minimum, maximum, adaptive=adaptive)
+        # the P1 meters have their own interval, by default the refresh interval with the same bounds
+        p1Seconds = int(pollConfig.get("p1_interval", nominal * HEARTBEAT_SECONDS))
+        p1Minimum = int(pollConfig.get("p1_min_interval", p1Seconds // HEARTBEAT_SECONDS // 2 * HEARTBEAT_SECONDS)) // HEARTBEAT_SECONDS
+        p1Maximum = int(pollConfig.get("p1_max_interval", 6 * p1Seconds)) // HEARTBEAT_SECONDS
+        self.p1Interval = AdaptiveInterval(p1Seconds // HEARTBEAT_SECONDS, p1Minimum, p1Maximum, adaptive=adaptive)
+        self.runCounter = self.batteryInterval.interval
+        self.p1Counter = self.p1Interval.interval
+        # the batteries are read at their own phase in the interval, slowly changing answers are reused (see SessyBase)
+        self.pollPlan = PollPlan(pollConfig.get("stagger", True))
+        # a battery snapshot counts for the system values for a few of the longest poll intervals
+        self.aggregator = SystemAggregator(max(SNAPSHOT_MAX_AGE, 3 * self.batteryInterval.maximum * HEARTBEAT_SECONDS))
+        self.integrators = {}
+        self.energyCheckpoint = getConfigItem("energy", {})
+        self.lastCheckpoint = time.monotonic()
+
+        # optional recording of every poll sample in ring files
+        recorderConfig = config_map.get("recorder", {})
+        self.recorder = None
+        if recorderConfig.get("enabled", False):
+            self.recorder = TelemetryRecorder(os.path.join(source_path, recorderConfig.get("folder", "history")), int(recorderConfig.get("capacity", DEFAULT_CAPACITY)))
+
+        self.metricsUnits = config_map.get("metrics", {}).get("devices", False)
+
+        # optional local zero-on-the-meter loop per site, switched on and off with the 'Local NoM control' unit
+        self.controlConfig = config_map.get("control", {})
+        self.controlEnabled = self.controlConfig.get("enabled", False)
+        self.controlMinChange = float(self.controlConfig.get("min_change", MIN_CHANGE))
+        self.controlSent = {}
+        self.controlFutures = {}
+
+        # the unit tables for this configuration, units can be left out or added in config.json
+        unitsConfig = config_map.get("units", {})
+        self.batterySpecs = self.unitTable("battery", self.batteryUnits, unitsConfig, BatterySnapshot.__slots__)
+        self.systemSpecs = self.unitTable("system", self.systemUnits, unitsConfig, SystemTotals.__slots__)
+        self.p1Specs = self.unitTable("p1meter", self.p1Units, unitsConfig)
+
+        # the devices of all sites by device id, as (system device of the site, device configuration)
+        batteryConfigs, meterConfigs = self.siteDevices(config_map)
+
+        # all API calls of all sites run on one worker pool, in event mode the heartbeat does not wait for them
+        workers = int(config_map.get("workers", min(MAX_POLL_WORKERS, len(batteryConfigs) + len(meterConfigs))))
+        self.pollPool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="SessyPoll")
+        self.eventDriven = config_map.get("transport", "blocking") == "event"
+        self.transport = EventTransport(self.pollPool)
+        self.cyclePending = set()
+        self.cycleQueue = {}
+        self.cycleOpen = False
+
+        self.sites = {} # by the device id of their system device
+        self.siteOf = {} # the site of every battery and P1 meter by device id
+        rejected = []
+        for site in siteConfigs(config_map, rejected):
+            self.sites[site["system_name"]] = Site(site["name"], site["system_name"], site["p1_name"], self.newController())
+        for site in rejected:
+            Domoticz.Error("site '" + site["name"] + "' uses the device id '" + site["system_name"] + "' or '" + site["p1_name"] + "' of another site, it is left out")
+            logging.error("site '" + site["name"] + "' uses the device id '" + site["system_name"] + "' or '" + site["p1_name"] + "' of another site, it is left out")
+
+        # create the p1 meters first, with more than one meter in a site its P1 device shows the site total
+        self.p1Meters = {}
+        self.p1Health = {}
+        # the device configurations that are in use, config.json changes are applied against these
+        self.appliedBatteries = {}
+        self.appliedMeters = {}
+        for deviceId, (systemName, meter) in meterConfigs.items():
+            if self.checkDevice(deviceId, meter):
+                self.addP1Meter(self.sites[systemName], deviceId, meter)
+                self.appliedMeters[deviceId] = (systemName, meter)
+        for site in self.sites.values():
+            if len(site.meters) > 1:
+                self.createUnits(site.p1Name, self.p1Specs)
+            if self.recorder is not None:
+                self.recorder.ring(site.p1Name, P1_FIELDS)
+        self.p1Pending = set()
+        self.pollP1()
 
         # create battery units
-        self.num_batteries = len(config_map["batteries"])
+        self.num_batteries = len(batteryConfigs)
         Domoticz.Log("Found " + str(self.num_batteries) + " batteries")
         logging.debug("Found " + str(self.num_batteries) + " batteries")
         
         self.devices_dict = {}
+        self.health = {}
+        self.snapshots = self.aggregator.snapshots # latest snapshot per battery, kept up to date by the aggregator
+        self.schedules = {}
+        self.pendingCommands = []
         devices_names = self.get_device_names(config_map)
-        for battery in config_map["batteries"]:
-            self.devices_dict[battery["name"]] = SessyBattery(battery)
-            self.createBatteryUnits(battery["name"])
-            data = self.devices_dict[battery["name"]].getPowerStatus()
-            logging.debug("initial data query power status '" + battery["name"] + "': " + str(data))
-            energy = self.devices_dict[battery["name"]].getEnergyStatus()
-            self.updateBatteryUnits(battery["name"], data, energy)
-            logging.debug("initial data query energy status '" + battery["name"] + "': " + str(energy))
-            self.updatePowerStrategy(battery["name"], self.devices_dict[battery["name"]].getPowerStrategy())
+        for name, (systemName, battery) in batteryConfigs.items():
+            if self.checkDevice(name, battery):
+                self.addBattery(self.sites[systemName], battery)
+                self.appliedBatteries[name] = (systemName, battery)
+        self.num_batteries = len(self.devices_dict)
         
-        #create system units
-        self.createSystemUnits(self.system_name)
-        self.updateSystemUnits(self.system_name, len(config_map["batteries"]))
-        self.updatePowerStrategy(self.system_name, "")
+        #create system units, they are updated as the answers of the batteries come in
+        for site in self.sites.values():
+            self.createUnits(site.systemName, self.systemSpecs)
+        # continue from the state saved before the restart, recent readings are shown right away
+        age = self.restoreState(getConfigItem("state", {}))
+        if age is not None and age < self.batteryInterval.seconds:
+            # the saved readings are still fresh, the regular poll follows when they would have been due
+            self.runCounter = max(1, self.batteryInterval.interval - int(age) // HEARTBEAT_SECONDS)
+            missing = [battery for battery in self.devices_dict if battery not in self.snapshots]
+            if len(missing) > 0:
+                self.pollBatteries(missing)
+        else:
+            # the first poll runs in the background, its answers are handled from the first heartbeat on
+            # so the startup does not depend on the devices being reachable
+            self.startCycle()
         self.enabled = True # onStart executed succesfull, enable heartbeats
         return
 
+    @bufferedUpdates
     def onHeartbeat(self):
+        if self.enabled:
+            self.handleMessages()
+            self.checkConfig()
         self.runCounter = self.runCounter - 1
+        self.p1Counter = self.p1Counter - 1
         if self.runCounter <= 0:
             logging.debug("Poll unit")
             if not self.enabled:
                 Domoticz.Log("Skipping updates since onStart not properly completed")
                 return
-            self.runCounter = int(Parameters['Mode2'])
-            for battery in self.devices_dict:
-                logging.debug("polling battery: '" +battery+"'")
-                for i in range(1, 4):
-                    try:
-                        powerData = self.devices_dict[battery].getPowerStatus()
-                        if powerData['status'] == 'ok':
-                            break
-                    except exceptions.RequestError as e:
-                        Domoticz.Error(f"an error occured while reading data from {battery}: {e}")
-                        logging.error(f"an error occured while reading data from {battery}: {e}")
-                        #return
-                    except requests.exceptions.RequestException as exp:
-                        logging.error("RequestException: " + str(exp))
-                        Domoticz.Error("RequestException: " + str(exp))
-                        #return
-                    time.sleep(i ** 3)
-                else:
-                    raise exceptions.TooManyRetries
-                for i in range(1, 4):
-                    try:
-                        energyData = self.devices_dict[battery].getEnergyStatus()
-                        if energyData['status'] == 'ok':
-                            break
-                    except exceptions.RequestError as e:
-                        Domoticz.Error(f"an error occured while reading data from {battery}: {e}")
-                        logging.error(f"an error occured while reading data from {battery}: {e}")
-                        #return
-                    except requests.exceptions.RequestException as exp:
-                        logging.error("RequestException: " + str(exp))
-                        Domoticz.Error("RequestException: " + str(exp))
-                        #return
-                    time.sleep(i ** 3)
-                else:
-                    raise exceptions.TooManyRetries
-                self.updateBatteryUnits(battery, powerData, energyData)
-                self.updatePowerStrategy(battery, self.devices_dict[battery].getPowerStrategy())
-                if datetime.now().minute == 1:
-                    # check if there is data
-                    self.devices_dict[battery].getDynamicSchedule()
-            self.updateSystemUnits("Sessy system", len(self.devices_dict))
-            self.updatePowerStrategy(self.system_name, "")
-
-            self.p1Counter = self.p1Counter - 1
-            if self.p1Counter <= 0:
-                self.p1Counter = P1_FACTOR
-                p1data = self.p1unit.getDetails()
-                logging.debug("P1 meter details: " + str(p1data))
-                self.updateP1Units("Sessy P1", p1data)
+            self.startCycle()
+        elif self.enabled:
+            if self.cycleOpen:
+                self.continueCycle()
+            # retry failed devices in between the regular polls, only their own units are refreshed
+            retries = [battery for battery in self.devices_dict if self.health[battery].retryDue()]
+            if len(retries) > 0:
+                self.pollBatteries(retries)
+
+        if self.enabled and self.p1Counter <= 0:
+            self.p1Counter = self.p1Interval.interval
+            self.pollP1()
+        elif self.enabled:
+            retries = [meter for meter in self.p1Meters if self.p1Health[meter].retryDue()]
+            if len(retries) > 0:
+                self.pollP1(retries)
 
+        if self.enabled and not self.eventDriven:
+            self.handleMessages(wait = True)
+        if self.enabled:
+            self.saveCheckpoint()
         logging.debug("Polling unit in " + str(self.runCounter) + " heartbeats.")
 
+    def onConnect(self, Connection, Status, Description):
+        """no Domoticz connections are used, the API calls run on the worker pool (see transport.py)"""
+        logging.debug("onConnect called for " + str(Connection))
+
+    def onMessage(self, Connection, Data):
+        logging.debug("onMessage called for " + str(Connection))
+
+    def onDisconnect(self, Connection):
+        logging.debug("onDisconnect called for " + str(Connection))
+
+    def handleMessages(self, wait = False):
+        """run the handlers of the API calls that have finished, with wait for all calls in flight"""
+        for key, handler, future in self.transport.receive(wait):
+            try:
+                handler(future)
+            except (LookupError, TypeError, ValueError, AttributeError) as e:
+                # an answer with unexpected content must not keep the others of the batch from their handlers
+                Domoticz.Error("handling the answer of " + key[0] + " " + str(key[1]) + " failed: " + repr(e))
+                logging.error("handling the answer of " + key[0] + " " + str(key[1]) + " failed: " + repr(e))
+
+    def startCycle(self):
+        """start a poll cycle: every battery is read once, at its own phase in the interval
+
+        the cycle is finished when the last battery has answered
+        """
+        self.runCounter = self.cycleInterval = self.batteryInterval.interval
+        self.cycleOpen = True
+        self.cycleStep = 0
+        # while commands wait for confirmation all batteries are read at once
+        self.cycleQueue = self.pollPlan.phases(list(self.devices_dict), self.cycleInterval if len(self.pendingCommands) == 0 else 1)
+        self.continueCycle()
+
+    def continueCycle(self):
+        """read the batteries whose phase has come, every heartbeat while the cycle is open"""
+        due = [battery for battery, phase in self.cycleQueue.items() if phase <= self.cycleStep]
+        for battery in due:
+            del self.cycleQueue[battery]
+        self.cycleStep += 1
+        due = [battery for battery in due if self.health[battery].isDue()]
+        if len(due) > 0:
+            self.pollBatteries(due, checkSchedule = True)
+        if len(self.cyclePending) == 0 and len(self.cycleQueue) == 0:
+            self.finishCycle()
+
+    def finishCycle(self):
+        self.cycleOpen = False
+        totals = self.aggregator.totals()
+        if totals is not None:
+            # the next cycle starts one interval after this one started
+            elapsed = self.cycleInterval - self.runCounter
+            self.runCounter = max(1, self.batteryInterval.update(totals.power, totals.powerSetpoint, self.gridPower) - elapsed)
+        self.confirmCommands()
+        for site in self.sites.values():
+            UpdateDevice(site.systemName, self.batPollIntervalUnit, 0, str(self.batteryInterval.seconds))
+            self.updateScheduleUnits(site)
+            if self.metricsUnits:
+                self.updateMetricsUnits(site.systemName)
+
+    @property
+    def gridPower(self):
+        """net grid power of all sites together (W), None before a P1 meter answered"""
+        powers = [site.gridPower for site in self.sites.values() if site.gridPower is not None]
+        return sum(powers) if len(powers) > 0 else None
+
+    @bufferedUpdates
     def onCommand(self, DeviceID, Unit, Command, Level, Hue):
         logging.debug("onCommand called for Device '" + str(DeviceID) + "', Unit '" + str(Unit) + "': Parameter '" + str(Command) + "', Level: " + str(Level))
+        if Unit == self.batDumpStatsUnit:
+            self.dumpMetrics()
+            return
+        site = self.sites.get(DeviceID, self.siteOf.get(DeviceID))
+        if site is None or (DeviceID != site.systemName and DeviceID not in self.devices_dict):
+            Domoticz.Error("device '" + str(DeviceID) + "' is no longer in the configuration, command ignored")
+            logging.error("device '" + str(DeviceID) + "' is no longer in the configuration, command ignored")
+            return
+        if Unit == self.batControlUnit:
+            self.setControl(site, Command == "On")
+            return
+        batteries = list(site.batteries) if DeviceID == site.systemName else [DeviceID] #if it's the system device, send update to all batteries of its site
+        if Unit in (self.batStrategyUnit, self.batPowerSetpointUnit) and self.controlActive(site):
+            # a manual command takes over from the local control loop
+            self.setControl(site, False, restoreStrategy = False)
         if Unit == self.batStrategyUnit:
             strat = PowerStrategy("")
             strat.state = Level/10
-            if DeviceID == self.system_name: #if it's the system device, send update to all
-                for battery in self.devices_dict:
-                    logging.debug( "commanding battery: '" +battery+"' with strategy '"+str(strat)+"'")
-                    self.devices_dict[battery].setStrategy(str(strat))
+            command = self.sendStrategy(batteries, strat)
+        elif Unit == self.batPowerSetpointUnit:
+            if DeviceID == site.systemName:
+                # divide the total over the batteries by their state, stale batteries are not sent anything
+                allocation = self.allocationEngine.allocate(Level, self.availability(batteries))
+                logging.debug("allocation of the system setpoint: %s", allocation)
+                if len(allocation.excluded) > 0:
+                    Domoticz.Log("setpoint " + str(Level) + " W, left out: " + ", ".join(battery + " (" + reason + ")" for battery, reason in allocation.excluded.items()))
+                    logging.info("setpoint " + str(Level) + " W, left out: " + ", ".join(battery + " (" + reason + ")" for battery, reason in allocation.excluded.items()))
+                setpoints = {battery: setpoint for battery, setpoint in allocation.setpoints.items() if not self.health[battery].stale}
             else:
-                logging.debug( "commanding battery: '" +DeviceID+"' with strategy '"+str(strat)+"'")
-                self.devices_dict[DeviceID].setStrategy(str(strat))
-        if Unit == self.batPowerSetpointUnit:
-            if DeviceID == self.system_name: #if it's the system device, send update to all
-                setpoint = Level/len(self.devices_dict) #average out the total setpoint over individul batteries
-                for battery in self.devices_dict:
-                    logging.debug( "commanding battery: '" +battery+"' with setpoint '"+str(Level)+"'")
-                    try:
-                        self.devices_dict[battery].setPowerSetpoint(setpoint)
-                    except exceptions.RequestError as e:
-                        logging.error(f"an error occured while commanding {battery}: {e}")
-                        Domoticz.Error(f"an error occured while commanding {battery}: {e}")
+                setpoints = {DeviceID: Level}
+            command = PendingCommand("setpoint " + str(Level) + " W", "powerSetpoint", setpoints)
+            for battery, setpoint in setpoints.items():
+                logging.debug( "commanding battery: '" +battery+"' with setpoint '"+str(setpoint)+"'")
+                command.futures[battery] = self.pollPool.submit(self.devices_dict[battery].setPowerSetpoint, setpoint)
+        else:
+            return
+        # the requests run in the background, the next polls confirm the batteries took the command
+        self.pendingCommands.append(command)
+        self.batteryInterval.tighten() # follow the reaction of the batteries closely
+        self.runCounter = 1 # poll at the next heartbeat to allow a bit of time to react
+
+    def availability(self, batteries):
+        """the allocation input of the batteries, from their latest poll without reading them again"""
+        states = []
+        for battery in batteries:
+            snapshot = self.snapshots.get(battery)
+            if self.health[battery].stale:
+                states.append(BatteryAvailability(battery, None, False, "stale"))
+            elif snapshot is None:
+                states.append(BatteryAvailability(battery, None, False, "not read yet"))
+            elif snapshot.strategyOverridden:
+                states.append(BatteryAvailability(battery, snapshot.stateOfCharge, False, "strategy overridden"))
             else:
-                logging.debug( "commanding battery: '" +DeviceID+"' with setpoint '"+str(Level)+"'")
-                try:
-                    self.devices_dict[DeviceID].setPowerSetpoint(Level)
-                except exceptions.RequestError as e:
-                    logging.error(f"an error occured while commanding {DeviceID}: {e}")
-                    Domoticz.Error(f"an error occured while commanding {DeviceID}: {e}")
-        self.runCounter = 1 # force update second next heartbeat to allow a bit of time to react
-        self.onHeartbeat()
-        
+                states.append(BatteryAvailability(battery, snapshot.stateOfCharge))
+        return states
+
+    def sendStrategy(self, batteries, strat):
+        """dispatch a power strategy to the batteries, returns the pending command"""
+        command = PendingCommand("strategy '" + str(strat) + "'", "strategy", dict.fromkeys(batteries, str(strat)))
+        self.pollPlan.request(batteries, (SessyBattery.strategyAPI,))
+        for battery in batteries:
+            logging.debug( "commanding battery: '" +battery+"' with strategy '"+str(strat)+"'")
+            command.futures[battery] = self.pollPool.submit(self.devices_dict[battery].setStrategy, str(strat))
+        return command
+
+    def newController(self):
+        """a local NoM controller with the configured tuning, None when the control loop is not enabled"""
+        if not self.controlEnabled:
+            return None
+        config = self.controlConfig
+        return NomController(float(config.get("target", 0)), float(config.get("deadband", DEADBAND)),
+            float(config.get("kp", KP)), float(config.get("ki", KI)), float(config.get("rate_limit", RATE_LIMIT)))
+
+    def controlActive(self, site):
+        """the local NoM loop of the site is configured and switched on"""
+        if site.controller is None:
+            return False
+        unit = Devices.get(site.systemName)
+        unit = unit.Units.get(self.batControlUnit) if unit is not None else None
+        return unit is not None and unit.nValue == 1
+
+    def setControl(self, site, active, restoreStrategy = True):
+        """switch the local NoM loop of a site on (batteries to the open API strategy) or off (back to the Sessy NoM strategy)"""
+        if site.controller is None:
+            return
+        UpdateDevice(site.systemName, self.batControlUnit, 1 if active else 0, "On" if active else "Off")
+        Domoticz.Log("local NoM control of " + site.systemName + " switched " + ("on" if active else "off"))
+        logging.info("local NoM control of " + site.systemName + " switched " + ("on" if active else "off"))
+        for battery in site.batteries:
+            self.controlSent.pop(battery, None)
+        if active:
+            totals = self.aggregator.totals(site.batteries)
+            site.controller.reset(0 if totals is None else totals.powerSetpoint)
+            strat = PowerStrategy(PowerStrategy.API)
+        elif restoreStrategy:
+            strat = PowerStrategy(PowerStrategy.NOM)
+        else:
+            return
+        self.pendingCommands.append(self.sendStrategy(list(site.batteries), strat))
+        self.p1Interval.tighten()
+        self.p1Counter = 1
+        self.runCounter = 1
+
+    def controlStep(self, site):
+        """one step of the local NoM loop of a site: new battery setpoints from its latest grid power, runs in the plugin thread"""
+        for battery, future in list(self.controlFutures.items()):
+            if future.done():
+                del self.controlFutures[battery]
+                if future.exception() is not None:
+                    self.controlSent.pop(battery, None) # send again at the next step
+                    Domoticz.Error(f"local NoM control could not set the setpoint of {battery}: {future.exception()}")
+                    logging.error(f"local NoM control could not set the setpoint of {battery}: {future.exception()}")
+        if site.gridPower is None:
+            return
+        # only batteries with a fresh reading that follow the open API strategy take part
+        batteries = self.availability(site.batteries)
+        limit = self.maxPower * sum(1 for battery in batteries if battery.available)
+        siteSetpoint = site.controller.update(site.gridPower, -limit, limit)
+        allocation = self.allocationEngine.allocate(siteSetpoint, batteries)
+        logging.debug("local NoM control of %s: grid %s W, %s", site.systemName, site.gridPower, allocation)
+        for battery, setpoint in allocation.setpoints.items():
+            if self.health[battery].stale or battery in self.controlFutures:
+                continue # unreachable, or the previous setpoint is still underway
+            previous = self.controlSent.get(battery)
+            if previous is not None and abs(setpoint - previous) < self.controlMinChange and (setpoint != 0 or previous == 0):
+                continue
+            self.controlSent[battery] = setpoint
+            self.controlFutures[battery] = self.pollPool.submit(self.devices_dict[battery].setPowerSetpoint, setpoint)
+
+    def confirmCommands(self):
+        """check the pending commands against the latest poll and report the ones that are finished"""
+        for command in list(self.pendingCommands):
+            if not command.dispatched:
+                continue
+            command.collectDispatch()
+            command.confirm(self.snapshots)
+            if command.field == "strategy":
+                self.pollPlan.request(command.waiting, (SessyBattery.strategyAPI,)) # read it again until it is confirmed
+            if command.finished:
+                self.pendingCommands.remove(command)
+                if len(command.failed) > 0:
+                    Domoticz.Error(command.report())
+                    logging.error(command.report())
+                else:
+                    Domoticz.Log(command.report())
+                    logging.info(command.report())
+        if len(self.pendingCommands) > 0:
+            self.runCounter = 1 # keep polling until every battery confirmed
+
     def onStop(self):
         logging.info("stopping plugin")
+        if self.enabled:
+            self.saveCheckpoint(force = True)
+            for line in metrics.report():
+                logging.info("stats " + line)
+        if getattr(self, "pollPool", None) is not None:
+            # Domoticz does not allow threads to outlive onStop, the request timeouts bound the wait;
+            # the sessions and the recorder are closed once no worker uses them anymore
+            self.pollPool.shutdown(wait=True, cancel_futures=True)
+        if getattr(self, "recorder", None) is not None:
+            self.recorder.close()
+        for device in getattr(self, "devices_dict", {}).values():
+            device.close()
+        for meter in getattr(self, "p1Meters", {}).values():
+            meter.close()
+
+    def pollBatteries(self, batteries = None, checkSchedule = False):
+        """send the reads of the batteries to the worker pool, their units are updated when the answers are handled
+
+        batteries that are waiting for a retry or have an open circuit breaker are skipped,
+        while a poll cycle is open the answers count towards finishing it,
+        with checkSchedule the dynamic schedules that are due for a refresh are fetched as well
+        """
+        if batteries is None:
+            batteries = [battery for battery in self.devices_dict if self.health[battery].isDue()]
+        now = datetime.now()
+        for battery in batteries:
+            logging.debug("polling battery: '" +battery+"'")
+            if self.transport.busy(("battery", battery)):
+                continue
+            fresh = self.pollPlan.refresh(battery)
+            handler = functools.partial(self.onBatteryMessage, battery, fresh)
+            if self.transport.send(("battery", battery), handler, self.readBattery, battery, fresh) and self.cycleOpen:
+                self.cyclePending.add(battery)
+            if checkSchedule and self.schedules[battery].needsRefresh(now):
+                self.schedules[battery].markFetched(now)
+                handler = functools.partial(self.onScheduleMessage, battery, now)
+                self.transport.send(("schedule", battery), handler, self.devices_dict[battery].getDynamicSchedule)
+
+    def onBatteryMessage(self, battery, fresh, future):
+        """handle the answer of readBattery, runs in the plugin thread
+
+        the system units are recomputed with every answer, so they follow each battery as it comes in
+        """
+        if battery not in self.devices_dict:
+            return # removed from the configuration while it was read
+        try:
+            self.handleBatteryAnswer(battery, fresh, future)
+        finally:
+            # the answer counts towards the cycle even when its units could not be updated
+            if battery in self.cyclePending:
+                self.cyclePending.discard(battery)
+                if self.cycleOpen and len(self.cyclePending) == 0 and len(self.cycleQueue) == 0:
+                    self.finishCycle()
+
+    def handleBatteryAnswer(self, battery, fresh, future):
+        try:
+            snapshot = future.result()
+        except (exceptions.RequestError, requests.exceptions.RequestException) as e:
+            self.pollPlan.request([battery], fresh) # still to be read fresh in the next attempt
+            self.markFailed(battery, self.health[battery], e)
+            return
+        if self.health[battery].recordSuccess():
+            Domoticz.Log(f"connection to {battery} restored")
+            logging.info(f"connection to {battery} restored")
+            UpdateDevice(battery, self.batErrorWarning, 0, "")
+        changed = snapshot.changedFields(self.snapshots.get(battery))
+        self.aggregator.update(battery, snapshot)
+        if self.recorder is not None:
+            self.recorder.recordBattery(battery, snapshot)
+        self.updateBatteryUnits(battery, snapshot, changed)
+        self.updateSystemUnits(self.siteOf[battery])
+
+    def onScheduleMessage(self, battery, now, future):
+        if battery not in self.schedules:
+            return
+        try:
+            self.schedules[battery].store(future.result(), now)
+        except (exceptions.ScheduleError, exceptions.RequestError, requests.exceptions.RequestException) as e:
+            Domoticz.Error(f"an error occured while reading the dynamic schedule from {battery}: {e}")
+            logging.error(f"an error occured while reading the dynamic schedule from {battery}: {e}")
+
+    def readBattery(self, battery, fresh = ()):
+        """runs in a worker thread: read power, energy and strategy of one battery into a snapshot
+
+        answers that are still fresh enough are taken from the device cache, the apis in fresh are always read
+        """
+        device = self.devices_dict[battery]
+        powerData = checkStatus(device.getPowerStatus())
+        energyData = checkStatus(device.getEnergyStatus(device.energyAPI in fresh))
+        strategyData = device.getPowerStrategy(device.strategyAPI in fresh)
+        return BatterySnapshot.fromResponses(powerData, energyData, strategyData)
+
+    def pollP1(self, meters = None):
+        """send the reads of the P1 meters to the worker pool, all meters are read at the same time"""
+        if meters is None:
+            meters = [meter for meter in self.p1Meters if self.p1Health[meter].isDue()]
+        for meter in meters:
+            handler = functools.partial(self.onP1Message, meter)
+            if self.transport.send(("p1", meter), handler, self.p1Meters[meter].getDetails):
+                self.p1Pending.add(meter)
+
+    def onP1Message(self, meter, future):
+        """handle the details of one P1 meter, runs in the plugin thread
+
+        the site total is published with every answer, the control loop of the site
+        runs once all its meters have answered and the P1 poll interval is adapted
+        once all meters that were read have answered
+        """
+        self.p1Pending.discard(meter)
+        if meter not in self.p1Meters:
+            return # removed from the configuration while it was read
+        health = self.p1Health[meter]
+        try:
+            p1data = checkStatus(future.result())
+        except (exceptions.RequestError, requests.exceptions.RequestException) as e:
+            self.markFailed(meter, health, e)
+            return
+        if health.recordSuccess():
+            Domoticz.Log(f"connection to {health.name} restored")
+            logging.info(f"connection to {health.name} restored")
+        site = self.siteOf[meter]
+        if site.grid.readings[meter] is None:
+            Domoticz.Log("connected to P1 meter '" + health.name + "', status is '"+ p1data["status"] + "'")
+            logging.debug("connected to P1 meter '" + health.name + "', status is '"+ p1data["status"] + "'")
+        logging.debug("P1 meter details of '%s': %s", health.name, p1data)
+        site.grid.update(meter, p1data)
+        site.updateGrid()
+        try:
+            if self.recorder is not None:
+                self.recorder.recordP1(meter, p1data)
+            self.updateP1Units(meter, p1data)
+            if meter != site.p1Name:
+                if self.recorder is not None:
+                    self.recorder.recordP1(site.p1Name, site.p1Data)
+                self.updateP1Units(site.p1Name, site.p1Data)
+        finally:
+            # the grid power drives the control loop and the interval even when its units could not be updated
+            self.afterP1Answer(site)
+
+    def afterP1Answer(self, site):
+        if self.controlActive(site) and self.p1Pending.isdisjoint(site.meters):
+            self.controlStep(site)
+        if len(self.p1Pending) == 0:
+            if any(self.controlActive(other) for other in self.sites.values()):
+                # the control loop needs the grid power at every heartbeat
+                self.p1Counter = 1
+            else:
+                # the tariff is a state, passed as text so any change counts and not only one of the threshold
+                tariffs = [None if other.p1Data is None or other.p1Data.get("tariff_indicator") is None else str(other.p1Data["tariff_indicator"])
+                    for other in self.sites.values()]
+                self.p1Counter = self.p1Interval.update(self.gridPower, *tariffs)
+            for other in self.sites.values():
+                UpdateDevice(other.systemName, self.batP1IntervalUnit, 0, str(self.p1Counter * HEARTBEAT_SECONDS))
+
+    def markFailed(self, deviceId, health, error):
+        """register a failed read, the device is skipped until its retry is due"""
+        if health.recordFailure(error):
+            Domoticz.Error(f"giving up on {health.name} for now after {health.failures} failed reads: {error}")
+            logging.error(f"giving up on {health.name} for now after {health.failures} failed reads: {error}")
+            if deviceId in self.devices_dict:
+                # an unreachable battery no longer counts for the system values
+                self.aggregator.expire(deviceId)
+                self.updateSystemUnits(self.siteOf[deviceId])
+        else:
+            Domoticz.Error(f"an error occured while reading data from {health.name}, will retry: {error}")
+            logging.error(f"an error occured while reading data from {health.name}, will retry: {error}")
+        if deviceId in self.devices_dict:
+            UpdateDevice(deviceId, self.batErrorWarning, 0, "stale: " + health.lastError)
+
+    def queryHistory(self, deviceId, start = None, end = None):
+        """recorded samples of a battery or a P1 meter ('Sessy P1' for the site) between two epoch times, see recorder.RingFile.query"""
+        if self.recorder is None:
+            return []
+        return self.recorder.query(deviceId, start, end)
+
+    def siteDevices(self, configmap):
+        """the battery and the P1 meter configurations of all sites by device id, as (system device of the site, configuration)
+
+        a site with a single P1 meter uses its site P1 device for it, a device id
+        can only be used once over all sites
+        """
+        batteries = {}
+        meters = {}
+        sites = siteConfigs(configmap)
+        systemNames = set(site["system_name"] for site in sites)
+        for site in sites:
+            p1meters = site["p1meter"]
+            siteMeters = {site["p1_name"]: p1meters[0]} if len(p1meters) == 1 else devicesByName(p1meters)
+            for devices, configs in ((batteries, devicesByName(site["batteries"])), (meters, siteMeters)):
+                for deviceId, config in configs.items():
+                    if deviceId in batteries or deviceId in meters or deviceId in systemNames:
+                        Domoticz.Error("device '" + deviceId + "' of " + site["system_name"] + " is configured more than once, it is left out")
+                        logging.error("device '" + deviceId + "' of " + site["system_name"] + " is configured more than once, it is left out")
+                        continue
+                    devices[deviceId] = (site["system_name"], config)
+        return batteries, meters
+
+    def joinSite(self, site, deviceId, devices):
+        """make the device part of the site, devices is the site list it belongs in"""
+        previous = self.siteOf.get(deviceId)
+        if previous is not None and previous is not site and deviceId in previous.batteries:
+            previous.batteries.remove(deviceId)
+        if previous is not None and previous is not site:
+            previous.grid.remove(deviceId)
+        self.siteOf[deviceId] = site
+        if devices is not None and deviceId not in devices:
+            devices.append(deviceId)
+
+    def addBattery(self, site, battery):
+        """set up a battery of a site from its configuration and create its units, an existing battery gets new connections"""
+        name = battery["name"]
+        device = SessyBattery(battery)
+        if name in self.devices_dict:
+            self.devices_dict[name].close()
+        self.joinSite(site, name, site.batteries)
+        self.devices_dict[name] = device
+        self.health[name] = DeviceHealth(name)
+        self.schedules.setdefault(name, ScheduleCache())
+        if self.recorder is not None:
+            self.recorder.ring(name, BATTERY_FIELDS)
+        self.createUnits(name, self.batterySpecs)
+
+    def removeBattery(self, name):
+        """stop using a battery, its units are left in Domoticz"""
+        self.devices_dict.pop(name).close()
+        self.siteOf.pop(name).batteries.remove(name)
+        for table in (self.health, self.schedules, self.integrators, self.controlSent):
+            table.pop(name, None)
+        self.aggregator.remove(name)
+        self.pollPlan.forget(name)
+        self.cyclePending.discard(name)
+        self.cycleQueue.pop(name, None)
+
+    def addP1Meter(self, site, deviceId, meter):
+        """set up a P1 meter of a site from its configuration and create its units, an existing meter gets new connections"""
+        device = SessyP1(meter)
+        if deviceId in self.p1Meters:
+            self.p1Meters[deviceId].close()
+        self.joinSite(site, deviceId, None)
+        self.p1Meters[deviceId] = device
+        self.p1Health[deviceId] = DeviceHealth(meter["name"])
+        site.grid.add(deviceId)
+        if self.recorder is not None:
+            self.recorder.ring(deviceId, P1_FIELDS)
+        self.createUnits(deviceId, self.p1Specs)
+
+    def removeP1Meter(self, deviceId):
+        self.p1Meters.pop(deviceId).close()
+        self.p1Health.pop(deviceId)
+        self.siteOf.pop(deviceId).grid.remove(deviceId)
+        self.p1Pending.discard(deviceId)
+
+    def checkDevice(self, deviceId, config):
+        """can the device configuration be set up, a problem is reported"""
+        problem = deviceProblem(config)
+        if problem is not None:
+            Domoticz.Error("device '" + str(deviceId) + "' in config.json can not be used: " + problem)
+            logging.error("device '" + str(deviceId) + "' in config.json can not be used: " + problem)
+        return problem is None
+
+    def applyDevice(self, kind, deviceId, setup, *args):
+        """set up one device of a config.json change, a failure is reported and leaves the others unaffected"""
+        try:
+            setup(*args)
+        except (LookupError, TypeError, ValueError, AttributeError, OSError) as e:
+            Domoticz.Error("the " + kind + " '" + deviceId + "' of config.json could not be set up: " + repr(e))
+            logging.error("the " + kind + " '" + deviceId + "' of config.json could not be set up: " + repr(e))
+            return False
+        return True
+
+    def checkConfig(self):
+        """apply changes of config.json: only the batteries and P1 meters that were added, removed or changed are set up again
+
+        the connections, readings and counters of the other devices are kept, changes to
+        the other sections take effect after a restart of the plugin. The changes are
+        taken against the devices in use: a device whose new configuration is invalid or
+        can not be set up keeps its previous configuration (a new one is not added) and is
+        set up again when a later save fixes it.
+        """
+        try:
+            config_map = self.configWatcher.changed()
+        except (OSError, ValueError) as e:
+            Domoticz.Error("config.json changed but can not be read, keeping the current configuration: " + str(e))
+            logging.error("config.json changed but can not be read, keeping the current configuration: " + str(e))
+            return
+        if config_map is None:
+            return
+        logging.info("config.json changed, config map = " + str(config_map))
+        try:
+            sites = [(site["name"], site["system_name"], site["p1_name"]) for site in siteConfigs(config_map)]
+            batteries, meters = self.siteDevices(config_map)
+        except (LookupError, TypeError, AttributeError) as e:
+            Domoticz.Error("the devices in config.json can not be read, keeping the current configuration: " + repr(e))
+            logging.error("the devices in config.json can not be read, keeping the current configuration: " + repr(e))
+            return
+        if sites != [(site["name"], site["system_name"], site["p1_name"]) for site in siteConfigs(self.config_map)]:
+            Domoticz.Log("the sites in config.json changed, the new configuration takes effect after a restart of the plugin")
+            logging.info("the sites in config.json changed, the new configuration takes effect after a restart of the plugin")
+            return
+        # moving a device to another site counts as a change of the device
+        added, removed, changed = diffDevices(self.appliedBatteries, batteries)
+        p1Added, p1Removed, p1Changed = diffDevices(self.appliedMeters, meters)
+        # every new configuration is checked before anything is changed
+        invalid = [deviceId for deviceId in changed + added if not self.checkDevice(deviceId, batteries[deviceId][1])]
+        invalid += [deviceId for deviceId in p1Changed + p1Added if not self.checkDevice(deviceId, meters[deviceId][1])]
+        applied = set()
+        for name in removed:
+            self.removeBattery(name)
+            del self.appliedBatteries[name]
+        controlled = {}
+        for name in changed + added:
+            # a new address or credentials: new connections, the readings and counters are kept
+            systemName, battery = batteries[name]
+            if name in invalid or not self.applyDevice("battery", name, self.addBattery, self.sites[systemName], battery):
+                continue
+            self.appliedBatteries[name] = batteries[name]
+            applied.add(name)
+            if self.controlActive(self.sites[systemName]):
+                controlled.setdefault(systemName, []).append(name)
+        # batteries that join a site under local NoM control take part in the loop as well
+        for names in controlled.values():
+            self.pendingCommands.append(self.sendStrategy(names, PowerStrategy(PowerStrategy.API)))
+        for deviceId in p1Removed:
+            self.removeP1Meter(deviceId)
+            del self.appliedMeters[deviceId]
+        for deviceId in p1Changed + p1Added:
+            systemName, meter = meters[deviceId]
+            if deviceId in invalid or not self.applyDevice("P1 meter", deviceId, self.addP1Meter, self.sites[systemName], deviceId, meter):
+                continue
+            self.appliedMeters[deviceId] = meters[deviceId]
+            applied.add(deviceId)
+        # the devices that could not be set up keep their previous configuration
+        added, changed, p1Added, p1Changed = [[deviceId for deviceId in names if deviceId in applied] for names in (added, changed, p1Added, p1Changed)]
+        for site in self.sites.values():
+            if len(site.meters) > 1:
+                self.createUnits(site.p1Name, self.p1Specs)
+        for section in changedSections(self.config_map, config_map):
+            Domoticz.Log("changes to '" + section + "' in config.json take effect after a restart of the plugin")
+            logging.info("changes to '" + section + "' in config.json take effect after a restart of the plugin")
+        self.config_map = config_map
+        self.num_batteries = len(self.devices_dict)
+        for kind, names in (("added", added + p1Added), ("removed", removed + p1Removed), ("reconnected", changed + p1Changed)):
+            if len(names) > 0:
+                Domoticz.Log("config.json: " + kind + " " + ", ".join(names))
+                logging.info("config.json: " + kind + " " + ", ".join(names))
+        if len(removed) + len(changed) + len(p1Removed) + len(p1Changed) > 0:
+            for site in self.sites.values():
+                site.updateGrid()
+                self.updateSystemUnits(site)
+        # the new devices are read right away, the others keep their rhythm
+        if len(added) + len(changed) > 0:
+            self.pollBatteries(added + changed)
+        if len(p1Added) + len(p1Changed) > 0:
+            self.pollP1(p1Added + p1Changed)
 
     def get_device_names(self, configmap):
         """find the amount of stored devices"""
         devices = {}
-        for x in configmap["p1meter"]:
-            devices[str(x["name"])] = "p1meter"
-        for x in configmap["batteries"]:
-            devices[str(x["name"])] = "battery"
+        for site in siteConfigs(configmap):
+            for x in site["p1meter"]:
+                devices[str(x["name"])] = "p1meter"
+            for x in site["batteries"]:
+                devices[str(x["name"])] = "battery"
         logging.debug("get_device_names, list of configured devices: " + str(devices))
         return devices
 
-    def createBatteryUnits(self, deviceId):
-        #check, per device, if it has units. If not,create them 
-        logging.debug("Creating units for: '" + deviceId +"'")
-        if deviceId not in Devices or (self.batPercentageUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery percentage', Unit=self.batPercentageUnit, TypeName="General", Subtype=6, Used=1, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batEnergyDeliveredUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + " - Battery delivered power", Unit=self.batEnergyDeliveredUnit, Type=243, Subtype=29, Switchtype=4, Used=1, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batEnergyStoredUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + " - Battery stored power", Unit=self.batEnergyStoredUnit, Type=243, Subtype=29, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batBatteryGeneralStateUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery general state', Unit=self.batBatteryGeneralStateUnit, TypeName="General", Subtype=19, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batBatteryDetailedStateUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery detailed state', Unit=self.batBatteryDetailedStateUnit, TypeName="General", Subtype=19, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batPowerUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery in/output power', Unit=self.batPowerUnit, Type=250, Subtype=1, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batPhase1VoltageUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery voltage L1', DeviceID=deviceId, Unit=(self.batPhase1VoltageUnit), Type=243, Subtype=8).Create()
-        if deviceId not in Devices or (self.batPhase1CurrentUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery current L1', DeviceID=deviceId, Unit=(self.batPhase1CurrentUnit), Type=243, Subtype=23).Create()
-        if deviceId not in Devices or (self.batPhase2VoltageUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery voltage L2', DeviceID=deviceId, Unit=(self.batPhase2VoltageUnit), Type=243, Subtype=8).Create()
-        if deviceId not in Devices or (self.batPhase2CurrentUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery current L2', DeviceID=deviceId, Unit=(self.batPhase2CurrentUnit), Type=243, Subtype=23).Create()
-        if deviceId not in Devices or (self.batPhase3VoltageUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery voltage L3', DeviceID=deviceId, Unit=(self.batPhase3VoltageUnit), Type=243, Subtype=8).Create()
-        if deviceId not in Devices or (self.batPhase3CurrentUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery current L3', DeviceID=deviceId, Unit=(self.batPhase3CurrentUnit), Type=243, Subtype=23).Create()
-        if deviceId not in Devices or (self.batStrategyUnit not in Devices[deviceId].Units):
-            Options = {"LevelActions" : "|||||",
-                "LevelNames" : "|NoM|Dynamic|Open API|Off|Sessy Connect|Eco|Mixed/unknown",
-                "LevelOffHidden" : "true",
-                "SelectorStyle" : "1"}
-            Domoticz.Unit(Name=deviceId + ' - Power strategy', DeviceID=deviceId, Unit=self.batStrategyUnit, TypeName="Selector Switch", Options=Options).Create()
-        if deviceId not in Devices or (self.batPowerSetpointUnit not in Devices[deviceId].Units):
-            Options = {'ValueStep':'100', 'ValueMin':str(self.minPower), 'ValueMax':str(self.maxPower), 'ValueUnit':'W'}
-            Options = {'ValueStep':'100', 'ValueMin':'-2200', 'ValueMax':'2200', 'ValueUnit':'W'}
-            Domoticz.Unit(Name=deviceId + ' - Battery power setpoint', Unit=self.batPowerSetpointUnit, Type=242, Subtype=1, Options=Options, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batErrorWarning not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery error/warning', Unit=self.batErrorWarning, TypeName="Text", Image=7, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batStrategyOverridden not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery strategy overridden', Unit=self.batStrategyOverridden, TypeName="Switch", DeviceID=deviceId).Create()
-
-    def updatePowerStrategy(self, deviceId, data):
-        if deviceId == self.system_name:
-            powerStrat = self.powerStrat // len(self.devices_dict)
-            remainder = self.powerStrat % len(self.devices_dict)
-            # TODO need a proper fix to find if all devices have the same mode
-            logging.debug("input: self.powerStrat = "+str(self.powerStrat) + " num devs: "+str(len(self.devices_dict))+" calculated strategy = "+str(powerStrat) + " and remainder "+str(remainder))
-            if remainder == 0:
-                UpdateDevice(deviceId, self.batStrategyUnit, powerStrat, str(powerStrat*10))
-            else:
-                UpdateDevice(deviceId, self.batStrategyUnit, 70, str(70))
-            self.powerStrat = 0
-        else:
-            powerStrat = PowerStrategy(data["strategy"])
-            self.powerStrat += powerStrat.state
-            UpdateDevice(deviceId, self.batStrategyUnit, powerStrat.state, str(powerStrat.state*10))
-        return
+    def unitTable(self, kind, specs, unitsConfig, fields = None):
+        """the unit specs of a kind of device for this configuration
 
-    def updateBatteryUnits(self, deviceId, powerData, energyData):
-        logging.debug("Updating units for: '" + deviceId +"'")
-        if "sessy" in powerData:
-            if "state_of_charge" in powerData["sessy"]:
-                #battery state of charge. Percentage with high number of decimals, needs to be trimmed
-                perc = round(powerData["sessy"]["state_of_charge"]*100,1)
-                self.systemPercent += perc
-                logging.debug(f"self.systemPercent = {self.systemPercent}, perc = {perc}" )
-                UpdateDevice(deviceId, self.batPercentageUnit, perc, str(perc))
-            if "power" in powerData["sessy"] and "sessy_energy" in energyData:
-                #power going in (negative) or out (positive) of the battery
-                power = round(powerData["sessy"]["power"],1) * -1 #domoticz wants it the other way around, apparantly.....
-                consPower = abs(power) if power < 0 else 0 # negative power is going into battery
-                prodPower = abs(power) if power > 0 else 0 # positive power is going out of battery
-                self.systemPower += power
-                RETURN1 = energyData["sessy_energy"]["export_wh"]
-                USAGE1 = energyData["sessy_energy"]["import_wh"]
-                RETURN2 ="0"
-                USAGE2 ="0"
-                self.systemPowerDelivered += prodPower
-                self.systemPowerStored += consPower
-                self.systemEnergyDelivered += RETURN1
-                self.systemEnergyStored += USAGE1
-                UpdateDevice(deviceId, self.batEnergyDeliveredUnit, 0, str(prodPower)+";"+str(RETURN1)) 
-                UpdateDevice(deviceId, self.batEnergyStoredUnit, 0, str(consPower)+";"+str(USAGE1)) 
-                powerString = str(USAGE1)+";"+USAGE2+";"+str(RETURN1)+";"+RETURN2+";"+str(consPower)+";"+str(prodPower)
-                #logging.debug("Powerstring = " + powerString)
-                UpdateDevice(deviceId, self.batPowerUnit, 0, powerString)
-            if "power_setpoint" in powerData["sessy"]:
-                powerSetpoint = powerData["sessy"]["power_setpoint"]
-                self.powerSetpoint += powerSetpoint
-                UpdateDevice(deviceId, self.batPowerSetpointUnit, powerSetpoint, str(powerSetpoint))
-            if "system_state" in powerData["sessy"]:
-                UpdateDevice(deviceId, self.batBatteryGeneralStateUnit, 1, str(powerData["sessy"]["system_state"]))
-            if "system_state_details" in powerData["sessy"]:
-                UpdateDevice(deviceId, self.batBatteryDetailedStateUnit, 1, str(powerData["sessy"]["system_state_details"]))
-            else:
-                UpdateDevice(deviceId, self.batBatteryDetailedStateUnit, 1, "all ok")
-            if "strategy_overridden" in powerData["sessy"]:
-                state = SwitchMode(str(powerData["sessy"]["strategy_overridden"]))
-                UpdateDevice(deviceId, self.batStrategyOverridden, state.state, str(state))
-        if "renewable_energy_phase1" in powerData:
-            if "voltage_rms" in powerData["renewable_energy_phase1"]:
-                UpdateDevice(deviceId, self.batPhase1VoltageUnit, 0, str(round(powerData["renewable_energy_phase1"]["voltage_rms"]/1000,0)))
-            if "current_rms" in powerData["renewable_energy_phase1"]:
-                UpdateDevice(deviceId, self.batPhase1CurrentUnit, 0, str(round(powerData["renewable_energy_phase1"]["current_rms"]/1000,1)))
-        if "renewable_energy_phase2" in powerData:
-            if "voltage_rms" in powerData["renewable_energy_phase2"]:
-                UpdateDevice(deviceId, self.batPhase2VoltageUnit, 0, str(round(powerData["renewable_energy_phase2"]["voltage_rms"]/1000,0)))
-            if "current_rms" in powerData["renewable_energy_phase1"]:
-                UpdateDevice(deviceId, self.batPhase2CurrentUnit, 0, str(round(powerData["renewable_energy_phase2"]["current_rms"]/1000,0)))
-        if "renewable_energy_phase3" in powerData:
-            if "voltage_rms" in powerData["renewable_energy_phase3"]:
-                UpdateDevice(deviceId, self.batPhase3VoltageUnit, 0, str(round(powerData["renewable_energy_phase3"]["voltage_rms"]/1000,0)))
-            if "current_rms" in powerData["renewable_energy_phase3"]:
-                UpdateDevice(deviceId, self.batPhase3CurrentUnit, 0, str(round(powerData["renewable_energy_phase3"]["current_rms"]/1000,1)))
-                
-        return
+        units that are not enabled or listed under "disabled" are left out, "custom" sensors are added,
+        their path has to be one of fields when the units show a record instead of the json answer
+        """
+        kindConfig = unitsConfig.get(kind, {})
+        disabled = set(kindConfig.get("disabled", []))
+        table = []
+        for spec in specs:
+            if not spec.wanted(self):
+                continue # an optional unit of a feature that is off
+            if spec.unit in disabled and spec.source is None:
+                Domoticz.Error("unit " + str(spec.unit) + " of the " + kind + " devices does not show polled data and can not be disabled")
+                logging.error("unit " + str(spec.unit) + " of the " + kind + " devices does not show polled data and can not be disabled")
+            elif spec.unit in disabled:
+                continue
+            table.append(spec)
+        used = set(spec.unit for spec in specs)
+        for custom in kindConfig.get("custom", []):
+            try:
+                spec = customSpec(custom)
+            except (KeyError, ValueError, TypeError) as e:
+                Domoticz.Error("invalid custom unit for the " + kind + " devices: " + str(custom) + " (" + str(e) + ")")
+                logging.error("invalid custom unit for the " + kind + " devices: " + str(custom) + " (" + str(e) + ")")
+                continue
+            if spec.unit in used or not 0 < spec.unit < 256:
+                Domoticz.Error("custom unit " + str(spec.unit) + " of the " + kind + " devices is already in use or out of range")
+                logging.error("custom unit " + str(spec.unit) + " of the " + kind + " devices is already in use or out of range")
+                continue
+            if fields is not None and spec.source not in fields:
+                Domoticz.Error("custom unit " + str(spec.unit) + " of the " + kind + " devices: '" + spec.source + "' is not one of " + ", ".join(fields))
+                logging.error("custom unit " + str(spec.unit) + " of the " + kind + " devices: '" + spec.source + "' is not one of " + ", ".join(fields))
+                continue
+            used.add(spec.unit)
+            table.append(spec)
+        return tuple(table)
 
-    def createSystemUnits(self, deviceId):
-        #check, per device, if it has units. If not,create them 
-        logging.debug("Creating units for: '" + deviceId +"'")
-        if deviceId not in Devices or (self.batPercentageUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery percentage', Unit=self.batPercentageUnit, TypeName="General", Subtype=6, Used=1, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batEnergyUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery energy', Unit=self.batEnergyUnit, Type=243, Subtype=29,  Used=1, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batPowerUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Battery in/output power', Unit=self.batPowerUnit, Type=250, Subtype=1, Used=1, DeviceID=deviceId).Create()
-        if deviceId not in Devices or (self.batStrategyUnit not in Devices[deviceId].Units):
-            Options = {"LevelActions" : "|||||",
-                "LevelNames" : "|NoM|Dynamic|Open API|Off|Sessy Connect|Eco|Mixed/unknown",
-                "LevelOffHidden" : "true",
-                "SelectorStyle" : "1"}
-            Domoticz.Unit(Name=deviceId + ' - Power strategy', DeviceID=deviceId, Unit=self.batStrategyUnit, TypeName="Selector Switch", Options=Options).Create()
-        if deviceId not in Devices or (self.batPowerSetpointUnit not in Devices[deviceId].Units):
-            Options = {'ValueStep':'100', 'ValueMin':str(-1 * self.maxPower * len(self.devices_dict)), 'ValueMax':str(self.maxPower * len(self.devices_dict)), 'ValueUnit':'W'}
-            #Options = {'ValueStep':'100', 'ValueMin':'-2200', 'ValueMax':'4400', 'ValueUnit':'W'}
-            logging.debug("options to create power setpoint: "+ str(Options))
-            Domoticz.Unit(Name=deviceId + ' - Battery power setpoint', Unit=self.batPowerSetpointUnit, Type=242, Subtype=1, Options=Options, DeviceID=deviceId).Create()
-
-    def updateSystemUnits(self, deviceId, numBatteries):
-        logging.debug("Updating units for: '" + deviceId +"'")
-        # overall SoC %
-        perc = round(self.systemPercent / numBatteries, 1)
-        logging.debug(f"perc: = {perc}, self.systemPercent={self.systemPercent}, numBatteries={numBatteries}")
-        UpdateDevice(deviceId, self.batPercentageUnit, perc, str(perc))
-        # update P1 meter
-        USAGE1 = self.systemEnergyStored
-        USAGE2 = 0
-        RETURN1 = self.systemEnergyDelivered
-        RETURN2 = 0
-        CONS = self.systemPowerStored
-        PROD = self.systemPowerDelivered
-        powerString = str(USAGE1) +";"+ str(USAGE2) +";"+ str(RETURN1) +";"+ str(RETURN2) +";"+ str(CONS) + ";"+ str(PROD) #+";"+ datetime.now().strftime(dt_format)
-        #logging.debug("compiled powerString: "+powerString)
-        UpdateDevice(deviceId, self.batPowerUnit, 0, powerString)
+    def createUnits(self, deviceId, specs):
+        """create the units of a device that do not exist yet, from one of the unit tables"""
+        device = Devices.get(deviceId)
+        existing = device.Units if device is not None else {}
+        for spec in specs:
+            if spec.unit not in existing:
+                logging.debug("Creating unit %s for: '%s'", spec.unit, deviceId)
+                Domoticz.Unit(**spec.unitArguments(self, deviceId)).Create()
+
+    def updateUnits(self, deviceId, specs, record, changed = None):
+        """show a polled record on the units of a table, with changed only the units depending on the changed fields"""
+        for spec in specs:
+            if spec.source is None or not spec.affectedBy(changed):
+                continue
+            reading = spec.reading(record)
+            if reading is not None:
+                UpdateDevice(deviceId, spec.unit, *reading)
+
+    def updateBatteryUnits(self, deviceId, snapshot, changed):
+        """update the units of a battery whose source fields are in changed"""
+        logging.debug("Updating units for: '%s', changed fields: %s", deviceId, changed)
+        self.updateUnits(deviceId, self.batterySpecs, snapshot, changed)
+        if snapshot.power is not None:
+            # the energy counter is integrated with every poll
+            power = round(snapshot.power,1) * -1 #domoticz wants it the other way around, apparantly.....
+            newCounter = self.integrateEnergy(deviceId, power)
+            UpdateDevice(deviceId, self.batEnergyUnit, 0, str(power)+";"+str(newCounter))
+
+    def updateSystemUnits(self, site):
+        """recompute the system units of a site from the fresh snapshots of its batteries"""
+        deviceId = site.systemName
+        totals = self.aggregator.totals(site.batteries)
+        logging.debug("Updating units for: '%s' from %s", deviceId, totals)
+        if totals is None:
+            return
+        self.updateUnits(deviceId, self.systemSpecs, totals)
         #update energy device
-        newCounter = calculateNewEnergy(deviceId, self.batEnergyUnit, self.systemPower)
-        powerString = str(self.systemPower)+";" + str(newCounter)
-        UpdateDevice(deviceId, self.batEnergyUnit, 0, powerString)
-        
-        UpdateDevice(deviceId, self.batPowerSetpointUnit, self.powerSetpoint, str(self.powerSetpoint))
-        
-        # reset variables used to sum up values from individual batteries
-        self.systemPercent = 0
-        self.systemPower = 0
-        self.systemPowerDelivered = 0
-        self.systemPowerStored = 0
-        self.systemEnergyDelivered = 0
-        self.systemEnergyStored = 0
-        self.powerSetpoint = 0
-        
+        power = round(totals.power, 1) * -1 # same sign as the battery units
+        newCounter = self.integrateEnergy(deviceId, power)
+        UpdateDevice(deviceId, self.batEnergyUnit, 0, str(power)+";" + str(newCounter))
+
+    def integrateEnergy(self, deviceId, power):
+        """add the power of a device to its energy counter, returns the counter in Wh"""
+        integrator = self.integrators.get(deviceId)
+        if integrator is None:
+            integrator = self.integrators[deviceId] = EnergyIntegrator()
+            checkpoint = self.energyCheckpoint.get(deviceId)
+            if checkpoint is not None:
+                integrator.restore(checkpoint)
+            else:
+                # no checkpoint yet, continue from the counter on display
+                try:
+                    integrator.energy = float(Devices[deviceId].Units[self.batEnergyUnit].sValue.split(";")[1])
+                except (KeyError, IndexError, ValueError):
+                    pass
+        return round(integrator.update(power), 2)
+
+    def saveCheckpoint(self, force = False):
+        """persist the energy counters and the warm state in the plugin configuration, at most every CHECKPOINT_INTERVAL seconds"""
+        if not force and time.monotonic() - self.lastCheckpoint < CHECKPOINT_INTERVAL:
+            return
+        self.lastCheckpoint = time.monotonic()
+        self.energyCheckpoint = {deviceId: integrator.checkpoint() for deviceId, integrator in self.integrators.items()}
+        setConfigItem("energy", self.energyCheckpoint)
+        setConfigItem("state", self.warmState())
 
-    def createP1Units(self, deviceId):
-        #check, per device, if it has units. If not,create them 
-        logging.debug("Creating units for: '" + deviceId +"'")
-        if deviceId not in Devices or (self.p1TarifUnit not in Devices[deviceId].Units):
-            Domoticz.Unit(Name=deviceId + ' - Tarif', Unit=self.p1TarifUnit, TypeName="General", Subtype=19, Used=1, DeviceID=deviceId).Create()
+    def warmState(self):
+        """what the plugin knows of the devices: the latest readings with their age, the device health and the schedules"""
+        now = time.monotonic()
+        return {"time": time.time(),
+            "snapshots": {battery: {"values": snapshot.checkpoint(), "age": self.aggregator.age(battery)} for battery, snapshot in self.snapshots.items()},
+            "p1": {meter: {"values": site.grid.readings[meter], "age": now - site.grid.times[meter]}
+                for site in self.sites.values() for meter in site.meters if site.grid.readings[meter] is not None},
+            "health": {battery: health.checkpoint() for battery, health in self.health.items()},
+            "p1Health": {meter: health.checkpoint() for meter, health in self.p1Health.items()},
+            "schedules": {battery: schedule.checkpoint() for battery, schedule in self.schedules.items()},
+            "control": {site.systemName: site.controller.setpoint for site in self.sites.values() if site.controller is not None}}
+
+    def restoreState(self, state):
+        """continue from a saved warm state and show it on the units, returns the age of the state in seconds (None without one)
+
+        devices that are no longer configured are skipped, readings that are too old
+        for the system values are restored as expired
+        """
+        if "time" not in state:
+            return None
+        age = max(0, time.time() - state["time"])
+        now = datetime.now()
+        try:
+            for battery, saved in state.get("snapshots", {}).items():
+                if battery in self.devices_dict:
+                    self.aggregator.restore(battery, BatterySnapshot(**saved["values"]), None if saved.get("age") is None else saved["age"] + age)
+            for meter, saved in state.get("p1", {}).items():
+                if meter in self.p1Meters:
+                    self.siteOf[meter].grid.update(meter, saved["values"], time.monotonic() - saved["age"] - age)
+            for battery, saved in state.get("health", {}).items():
+                if battery in self.health:
+                    self.health[battery].restore(saved)
+            for meter, saved in state.get("p1Health", {}).items():
+                if meter in self.p1Health:
+                    self.p1Health[meter].restore(saved)
+            for battery, saved in state.get("schedules", {}).items():
+                if battery in self.schedules:
+                    self.schedules[battery].restore(saved, now)
+            control = state.get("control")
+            for site in self.sites.values():
+                if site.controller is not None and isinstance(control, dict) and control.get(site.systemName) is not None:
+                    site.controller.reset(control[site.systemName])
+        except (KeyError, TypeError, ValueError) as e:
+            Domoticz.Error("the saved state could not be restored, starting cold: " + str(e))
+            logging.error("the saved state could not be restored, starting cold: " + str(e))
+            return None
+        logging.info("restored the state of " + str(len(self.snapshots)) + " batteries and " + str(len(state.get("p1", {}))) + " P1 meters, saved " + str(round(age)) + " s ago")
+        for battery, snapshot in self.snapshots.items():
+            self.updateUnits(battery, self.batterySpecs, snapshot)
+        for site in self.sites.values():
+            totals = self.aggregator.totals(site.batteries)
+            if totals is not None:
+                self.updateUnits(site.systemName, self.systemSpecs, totals)
+            if site.updateGrid() is not None:
+                for meter in site.meters:
+                    if site.grid.readings[meter] is not None:
+                        self.updateP1Units(meter, site.grid.readings[meter])
+                if site.p1Name not in self.p1Meters:
+                    self.updateP1Units(site.p1Name, site.p1Data)
+            self.updateScheduleUnits(site)
+        return age
+
+    def updateMetricsUnits(self, deviceId):
+        """publish the p50, p95 and max of the heartbeat, the p95 of all API calls and the slowest device/API"""
+        heartbeat = metrics.get("onHeartbeat")
+        if heartbeat is not None:
+            p50, p95, highest = heartbeat.summary()
+            UpdateDevice(deviceId, self.batHeartbeatMedianUnit, 0, str(round(p50 * 1000, 1)))
+            UpdateDevice(deviceId, self.batHeartbeatTimeUnit, 0, str(round(p95 * 1000, 1)))
+            UpdateDevice(deviceId, self.batHeartbeatMaxUnit, 0, str(round(highest * 1000, 1)))
+        slowest = metrics.slowest("api ")
+        if slowest is not None:
+            name, (p50, p95, highest) = slowest
+            UpdateDevice(deviceId, self.batApiLatencyUnit, 0, str(round(p95 * 1000, 1)))
+            UpdateDevice(deviceId, self.batSlowestApiUnit, 0, name[4:] + ": p50 " + str(round(p50 * 1000)) + " ms, p95 " + str(round(p95 * 1000)) + " ms, max " + str(round(highest * 1000)) + " ms")
+
+    def dumpMetrics(self):
+        """write the timing statistics of all measurements to the log"""
+        for line in metrics.report():
+            Domoticz.Log("stats " + line)
+            logging.info("stats " + line)
+
+    def updateScheduleUnits(self, site):
+        """publish price information from the cached dynamic schedules, prices are the same for all batteries of a site"""
+        deviceId = site.systemName
+        now = datetime.now()
+        for schedule in (self.schedules[battery] for battery in site.batteries):
+            price = schedule.priceAt(now)
+            if price is None:
+                continue
+            UpdateDevice(deviceId, self.batEnergyPriceUnit, 0, str(round(price, 4)))
+            cheapest = schedule.cheapestFrom(now)
+            UpdateDevice(deviceId, self.batCheapestPriceUnit, 0, cheapest[0].strftime("%Y-%m-%d %H:%M") + ": " + str(round(cheapest[1], 4)) + " EUR/kWh")
+            return
 
     def updateP1Units(self, deviceId, data):
         logging.debug("Updating units for: '" + deviceId +"'")
-        if "tariff_indicator" in data:
-            #1 is low tarif, 2 is high tarif
-            UpdateDevice(deviceId, self.p1TarifUnit, 1, str(data["tariff_indicator"]))
+        self.updateUnits(deviceId, self.p1Specs, data)
+
+def checkStatus(data):
+    """raise an error when a Sessy answer does not report status 'ok'"""
+    if data.get('status') != 'ok':
+        raise exceptions.RequestError(200, data.get('error', data.get('status')))
+    return data
 
 class SessyBase():
+    timeouts = {} # per api timeout in seconds, overrides the device default
+    maxAges = {} # per api seconds an answer is reused before the device is asked again, apis not listed are always read
+    invalidates = {} # per api that is posted to, the other apis whose answers change by it
+
     def __init__(self, config):
-        logging.debug("init Sessy device: " + str(config))
+        logging.debug("init Sessy device: " + config["name"] + " at " + config["ip"])
         self.__name = config["name"]
         self.ip = config["ip"]
         self.user = config["user"]
         self.pwd = config["pwd"]
-        self.base_url = 'http://'+ self.user + ':' + self.pwd + '@' + self.ip 
+        self.base_url = 'http://' + self.ip
+        self.timeout = float(config.get("timeout", DEFAULT_TIMEOUT))
+        self.timeouts = dict(self.timeouts)
+        self.timeouts.update(config.get("timeouts", {}))
+        self.maxAges = dict(self.maxAges)
+        self.maxAges.update(config.get("max_ages", {}))
+        # answers of the apis with a max age by api: (time read, answer), shared by the worker threads
+        self.cache = {}
+        self.generations = {} # per api the number of invalidations, an answer read across one is not cached
+        self.cacheLock = threading.Lock()
+        self.pool_size = int(config.get("pool_size", DEFAULT_POOL_SIZE))
+        # one keep-alive session per device, the connections are reused between polls
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(self.user, self.pwd)
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
 
     @property
     def name(self):
         return self.__name
 
-    def GetDataFromDevice(self, api):
-        logging.debug("get data from: " + self.base_url + api)
-        response = requests.get(self.base_url + api, timeout=6)
+    def getTimeout(self, api):
+        return self.timeouts.get(api, self.timeout)
+
+    def GetDataFromDevice(self, api, fresh = False):
+        """answer of the api, a cached answer younger than the max age of the api is reused unless fresh is asked for"""
+        maxAge = self.maxAges.get(api)
+        with self.cacheLock:
+            cached = self.cache.get(api)
+            generation = self.generations.get(api, 0)
+        now = time.monotonic()
+        if maxAge is not None and not fresh and cached is not None and now - cached[0] < maxAge:
+            logging.debug("cached answer of %s%s", self.base_url, api)
+            return cached[1]
+        logging.debug("get data from: %s%s", self.base_url, api)
+        with metrics.timer("api " + self.name + " GET " + api):
+            response = self.session.get(self.base_url + api, timeout=self.getTimeout(api))
+        # the body is decoded exactly once, also for error answers
+        try:
+            data = jsonLoads(response.content)
+        except ValueError:
+            data = {"status": "invalid", "error": response.text}
         if response.status_code != 200:
-            logging.error("error during GET: status code"+str(response.status_code)+", status: "+response.json()['status']+", error: "+response.json()['error'])
-            raise exceptions.RequestError(response.status_code, response.json()['error'])
-        return response.json()
+            logging.error("error during GET: status code %s, status: %s, error: %s", response.status_code, data.get('status'), data.get('error'))
+            raise exceptions.RequestError(response.status_code, data.get('error'))
+        if maxAge is not None and data.get('status', 'ok') == 'ok':
+            with self.cacheLock:
+                if self.generations.get(api, 0) == generation:
+                    self.cache[api] = (now, data)
+        return data
 
     def PostDataToDevice(self, api, json):
-        logging.debug("post data to: " + self.base_url + api)
-        response = requests.post(self.base_url + api, json = json)
+        logging.debug("post data to: %s%s", self.base_url, api)
+        with metrics.timer("api " + self.name + " POST " + api):
+            response = self.session.post(self.base_url + api, json = json, timeout=self.getTimeout(api))
+        # whatever the answer, the cached state of the device may no longer be right
+        self.invalidate(api, *self.invalidates.get(api, ()))
         return response
 
+    def invalidate(self, *apis):
+        """forget the cached answers of the apis, also an answer that is being read right now"""
+        with self.cacheLock:
+            for api in apis:
+                self.cache.pop(api, None)
+                self.generations[api] = self.generations.get(api, 0) + 1
+
+    def close(self):
+        """release the pooled connections of this device"""
+        self.session.close()
+
 class SessyBattery(SessyBase):
     dynamicScheduleAPI = '/api/v1/dynamic/schedule'
     #dynamicScheduleAPI = '/api/v1/energy/status'
@@ -527,44 +1381,50 @@ class SessyBattery(SessyBase):
     powerAPI = '/api/v1/power/status'
     strategyAPI = '/api/v1/power/active_strategy'
     powerSetpointAPI = '/api/v1/power/setpoint'
+    timeouts = {dynamicScheduleAPI: 10}
+    # the energy counters move slowly, the strategy only changes by a command or the Sessy app
+    maxAges = {energyAPI: 300, strategyAPI: 600}
+    invalidates = {powerSetpointAPI: (powerAPI,)}
 
     def getDynamicSchedule(self):
         dt_format = "%Y-%m-%d"
         data = self.GetDataFromDevice(self.dynamicScheduleAPI)
-        logging.debug("dynamic scheule for '" + str(SessyBase.name) + "': '"+str(data))
+        logging.debug("dynamic scheule for '%s': '%s'", self.name, data)
         if "power_strategy" not in data or len(data["power_strategy"]) < 1:
             raise exceptions.ScheduleError("power strategy", datetime.now().strftime(dt_format))
         if "energy_prices" not in data or len(data["energy_prices"]) < 1:
             raise exceptions.ScheduleError("energy prices", datetime.now().strftime(dt_format))
         return data
 
-    def getEnergyStatus(self):
-        data = self.GetDataFromDevice(self.energyAPI)
-        logging.debug("energy status for '" + str(SessyBase.name) + "': '"+str(data))
+    def getEnergyStatus(self, fresh = False):
+        data = self.GetDataFromDevice(self.energyAPI, fresh)
+        logging.debug("energy status for '%s': '%s'", self.name, data)
         return data
 
     def getPowerStatus(self):
         data = self.GetDataFromDevice(self.powerAPI)
-        logging.debug("power status for '" + str(SessyBase.name) + "': '"+str(data))
+        logging.debug("power status for '%s': '%s'", self.name, data)
         return data
 
     def setPowerSetpoint(self, setpoint):
         body = {"setpoint":setpoint}
         data = self.PostDataToDevice(self.powerSetpointAPI, body)
-        logging.debug("power setpoint for '" + str(SessyBase.name) + "': '"+str(data))
+        logging.debug("power setpoint for '%s': '%s'", self.name, data)
         if data.status_code != 200:
             raise exceptions.RequestError(data.status_code, data.json()['error'])
         return data
 
-    def getPowerStrategy(self):
-        data = self.GetDataFromDevice(self.strategyAPI)
-        logging.debug("power strategy for '" + str(SessyBase.name) + "': '"+str(data))
+    def getPowerStrategy(self, fresh = False):
+        data = self.GetDataFromDevice(self.strategyAPI, fresh)
+        logging.debug("power strategy for '%s': '%s'", self.name, data)
         return data
 
     def setStrategy(self, strategy):
         body = {"strategy":strategy}
         data = self.PostDataToDevice(self.strategyAPI, body)
-        logging.debug("power strategy for '" + str(SessyBase.name) + "': '"+str(data))
+        logging.debug("power strategy for '%s': '%s'", self.name, data)
+        if data.status_code != 200:
+            raise exceptions.RequestError(data.status_code, data.json()['error'])
         return data
 
 class SessyP1(SessyBase):
@@ -573,7 +1433,7 @@ class SessyP1(SessyBase):
 
     def getDetails(self):
         self.data = self.GetDataFromDevice(self.detailsAPI)
-        logging.debug("p1 status for '" + str(SessyBase.name) + "': '"+str(self.data))
+        logging.debug("p1 status for '%s': '%s'", self.name, self.data)
         return self.data
 
     @property
@@ -730,55 +1590,73 @@ def DumpConfigToLog():
         Domoticz.Debug("Device:           " + str(x) + " - " + str(Devices[x]))
     return
 
+class UnitUpdateBuffer():
+    """Collects unit updates during a poll cycle and writes them in one go
+
+    Used as a context manager around a callback, UpdateDevice calls inside it
+    are buffered per unit so only the last value of each unit is written when
+    the outermost block ends. Units already showing that value are skipped.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.depth = 0
+
+    @property
+    def active(self):
+        return self.depth > 0
+
+    def __enter__(self):
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            self.flush()
+        return False
+
+    def add(self, Device, Unit, nValue, sValue, AlwaysUpdate, Name):
+        key = (Device, Unit)
+        previous = self.pending.get(key)
+        if previous is not None:
+            AlwaysUpdate = AlwaysUpdate or previous[2]
+            Name = Name or previous[3]
+        self.pending[key] = (nValue, sValue, AlwaysUpdate, Name)
+
+    def flush(self):
+        pending = self.pending
+        self.pending = {}
+        with metrics.timer("unit flush"):
+            for (Device, Unit), (nValue, sValue, AlwaysUpdate, Name) in pending.items():
+                WriteUnit(Device, Unit, nValue, sValue, AlwaysUpdate, Name)
+
+updateBuffer = UnitUpdateBuffer()
+debugLogging = False # set by the plugin, avoids building debug messages nobody will see
+
 def UpdateDevice(Device, Unit, nValue, sValue, AlwaysUpdate=False, Name=""):
-    # Make sure that the Domoticz device still exists (they can be deleted) before updating it
-    if (Device in Devices and Unit in Devices[Device].Units):
-        if (Devices[Device].Units[Unit].nValue != nValue) or (Devices[Device].Units[Unit].sValue != sValue) or AlwaysUpdate:
-                Domoticz.Debug("Updating device '"+Devices[Device].Units[Unit].Name+ "' with current sValue '"+Devices[Device].Units[Unit].sValue+"' to '" +sValue+"'")
-                logging.debug("Updating device '"+Devices[Device].Units[Unit].Name+ "' with current sValue '"+Devices[Device].Units[Unit].sValue+"' to '" +sValue+"'")
-            #try:
-                if isinstance(nValue, int):
-                    Devices[Device].Units[Unit].nValue = nValue
-                else:
-                    Domoticz.Log("nValue supplied is not an integer. Device: "+str(Device)+ " unit "+str(Unit)+" nValue "+str(nValue))
-                    Devices[Device].Units[Unit].nValue = int(nValue)
-                Devices[Device].Units[Unit].sValue = sValue
-                if Name != "":
-                    Devices[Device].Units[Unit].Name = Name
-                Devices[Device].Units[Unit].Update()
-                
-                #logging.debug("Update "+str(nValue)+":'"+str(sValue)+"' ("+Devices[Device].Units[Unit].Name+")")
-            # except:
-                # Domoticz.Error("Update of device failed: "+str(Unit)+"!")
-                # logging.error("Update of device failed: "+str(Unit)+"!")
+    if updateBuffer.active:
+        updateBuffer.add(Device, Unit, nValue, sValue, AlwaysUpdate, Name)
     else:
+        WriteUnit(Device, Unit, nValue, sValue, AlwaysUpdate, Name)
+
+def WriteUnit(Device, Unit, nValue, sValue, AlwaysUpdate=False, Name=""):
+    # Make sure that the Domoticz device still exists (they can be deleted) before updating it
+    device = Devices.get(Device)
+    unit = device.Units.get(Unit) if device is not None else None
+    if unit is None:
         Domoticz.Error("trying to update a non-existent unit "+str(Unit)+" from device "+str(Device))
+        return
+    if unit.nValue != nValue or unit.sValue != sValue or AlwaysUpdate:
+        if debugLogging:
+            Domoticz.Debug("Updating device '"+unit.Name+ "' with current sValue '"+unit.sValue+"' to '" +sValue+"'")
+        logging.debug("Updating device '%s' with current sValue '%s' to '%s'", unit.Name, unit.sValue, sValue)
+        if isinstance(nValue, int):
+            unit.nValue = nValue
+        else:
+            Domoticz.Log("nValue supplied is not an integer. Device: "+str(Device)+ " unit "+str(Unit)+" nValue "+str(nValue))
+            unit.nValue = int(nValue)
+        unit.sValue = sValue
+        if Name != "":
+            unit.Name = Name
+        unit.Update()
     return
-
-def calculateNewEnergy(Device, Unit, inputPower):
-    #helper method to get current energy level from device and create new value based on input power
-    try:
-        #read power currently on display (comes from previous update) in Watt and energy counter uptill now in Wh
-        previousPower,currentCount = Devices[Device].Units[Unit].sValue.split(";") 
-    except:
-        #in case no values there, just assume zero
-        previousPower = 0 #Watt
-        currentCount = 0 #Wh
-    dt_format = "%Y-%m-%d %H:%M:%S"
-    try:
-        dt_string = Devices[Device].Units[Unit].LastUpdate
-    except:
-        dt_string = datetime.now().strftime(dt_format)
-    if len(dt_string) > 0:
-        lastUpdateDT = datetime.fromtimestamp(time.mktime(time.strptime(dt_string, dt_format)))
-    else:
-        lastUpdateDT = datetime.now()
-    elapsedTime = datetime.now() - lastUpdateDT
-    #logging.debug("Test power, previousPower: {}, last update: {:%Y-%m-%d %H:%M}, elapsedTime: {}, elapsedSeconds: {:6.2f}".format(previousPower, lastUpdateDT, elapsedTime, elapsedTime.total_seconds()))
-    
-    #average current and previous power (Watt) and multiply by elapsed time (hour) to get Watt hour
-    previousPower = str(previousPower).replace("w","").replace("W","")
-    newCount = round(((float(previousPower) + inputPower ) / 2) * elapsedTime.total_seconds()/3600,2)
-    newCounter = newCount + float(currentCount) #add the amount of energy since last update to the already logged energy
-    #logging.debug("Test power, previousPower: {}, currentCount: {:6.2f}, newCounter: {:6.2f}, added: {:6.2f}".format(previousPower, float(currentCount), newCounter, newCount))
-    return newCounter
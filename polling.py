@@ -0,0 +1,166 @@
+"""Sessy polling helpers"""
+import random
+import time
+
+RETRY_BASE_DELAY = 10 # seconds before the first retry of a failed device, about one heartbeat
+RETRY_MAX_DELAY = 300 # upper limit of the delay between retries
+RETRY_JITTER = 0.2 # retry delays are spread +/- this fraction to avoid retrying all devices at once
+BREAKER_THRESHOLD = 5 # consecutive failures before the circuit breaker opens
+BREAKER_OPEN_TIME = 600 # seconds a device is left alone once the breaker is open
+
+class DeviceHealth():
+    """Retry bookkeeping and circuit breaker for one Sessy device
+
+    A failed read is not retried on the spot. Instead the next attempt is
+    scheduled a little later with exponential backoff and jitter, so the
+    heartbeat never waits for an unreachable device. After too many failures
+    in a row the breaker opens and the device is skipped for a longer time,
+    after which a single probe decides whether it is back (half open).
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half open'
+
+    def __init__(self, name, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.nextAttempt = 0
+        self.lastError = ""
+
+    @property
+    def stale(self):
+        """True when the last read of this device failed"""
+        return self.failures > 0
+
+    def isDue(self):
+        """is the device allowed to be polled now"""
+        if self.clock() < self.nextAttempt:
+            return False
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+        return True
+
+    def retryDue(self):
+        """a failed device whose retry time has come, used between regular polls"""
+        return self.stale and self.isDue()
+
+    def recordSuccess(self):
+        """register a good read, returns True when the device recovered from a failure"""
+        recovered = self.stale
+        self.state = self.CLOSED
+        self.failures = 0
+        self.nextAttempt = 0
+        self.lastError = ""
+        return recovered
+
+    def recordFailure(self, error):
+        """register a failed read and schedule the next attempt, returns True when the breaker opened"""
+        self.failures += 1
+        self.lastError = str(error)
+        if self.state == self.HALF_OPEN or self.failures >= BREAKER_THRESHOLD:
+            self.state = self.OPEN
+            self.nextAttempt = self.clock() + BREAKER_OPEN_TIME
+            return True
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (self.failures - 1))
+        self.nextAttempt = self.clock() + delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+        return False
+
+    def checkpoint(self):
+        """state to persist, the next attempt in wall clock time since the monotonic clock does not survive a restart"""
+        return {"state": self.state, "failures": self.failures, "lastError": self.lastError,
+            "nextAttempt": time.time() + max(0, self.nextAttempt - self.clock())}
+
+    def restore(self, state):
+        self.state = state.get("state", self.CLOSED)
+        self.failures = int(state.get("failures", 0))
+        self.lastError = state.get("lastError", "")
+        self.nextAttempt = self.clock() + max(0, state.get("nextAttempt", 0) - time.time())
+
+class PollPlan():
+    """When each battery is read within a poll interval, and which of its apis have to be read fresh
+
+    Every battery gets its own phase in the interval, so the reads are spread
+    over the heartbeats instead of all starting in the same one. Answers that
+    change slowly are cached by the device, an api can be requested to be
+    read fresh in the next poll, e.g. to confirm a command.
+    """
+    def __init__(self, stagger=True):
+        self.stagger = stagger
+        self.requested = {} # battery -> apis to read fresh in its next poll
+
+    def phases(self, batteries, interval):
+        """heartbeat within the interval at which each battery is read, 0 is the start of the interval"""
+        count = len(batteries)
+        if not self.stagger:
+            return dict.fromkeys(batteries, 0)
+        return {battery: index * interval // count for index, battery in enumerate(batteries)}
+
+    def refresh(self, battery):
+        """the apis to read fresh in this poll of the battery"""
+        return frozenset(self.requested.pop(battery, ()))
+
+    def request(self, batteries, apis):
+        """read these apis fresh in the next poll of the batteries"""
+        for battery in batteries:
+            self.requested.setdefault(battery, set()).update(apis)
+
+    def forget(self, battery):
+        self.requested.pop(battery, None)
+
+HEARTBEAT_SECONDS = 10 # default Domoticz heartbeat
+POWER_CHANGE_THRESHOLD = 100 # change in Watt between polls that counts as activity
+
+class AdaptiveInterval():
+    """Poll interval, in heartbeats, that follows the activity of what is polled
+
+    Every poll feeds its key values in. When one of them moved more than the
+    threshold (or a state like the tariff flipped) the interval is halved,
+    while stable values stretch it one heartbeat at a time, always within
+    the configured bounds.
+    """
+    def __init__(self, nominal, minimum, maximum, threshold=POWER_CHANGE_THRESHOLD, adaptive=True):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.threshold = threshold
+        self.adaptive = adaptive
+        self.interval = min(self.maximum, max(self.minimum, int(nominal))) if adaptive else max(1, int(nominal))
+        self.previous = None
+
+    @property
+    def seconds(self):
+        return self.interval * HEARTBEAT_SECONDS
+
+    def update(self, *values):
+        """feed the values of the latest poll (None for unknown), returns the new interval
+
+        numbers count as a change when they moved by the threshold, states (pass them as
+        text, e.g. the tariff) on any change
+        """
+        if not self.adaptive:
+            return self.interval
+        if self.previous is not None:
+            if self.changed(self.previous, values):
+                self.interval = max(self.minimum, self.interval // 2)
+            else:
+                self.interval = min(self.maximum, self.interval + 1)
+        self.previous = values
+        return self.interval
+
+    def changed(self, previous, values):
+        """did any of the values change, numbers by at least the threshold"""
+        for old, new in zip(previous, values):
+            if old is None or new is None:
+                continue
+            if isinstance(new, (int, float)) and not isinstance(new, bool):
+                if abs(new - old) >= self.threshold:
+                    return True
+            elif new != old:
+                return True
+        return False
+
+    def tighten(self):
+        """something is about to change (e.g. a command was sent), poll at the fastest rate"""
+        if self.adaptive:
+            self.interval = self.minimum
@@ -0,0 +1,129 @@
+"""Recording of the raw telemetry in fixed size ring files"""
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+import time
+
+DEFAULT_CAPACITY = 100000 # samples per device, about 23 days at 20 s polling
+BATTERY_FIELDS = ('stateOfCharge', 'power', 'powerSetpoint', 'phase1Voltage', 'phase1Current', 'phase2Voltage', 'phase2Current',
+    'phase3Voltage', 'phase3Current', 'importWh', 'exportWh')
+P1_FIELDS = ('power_total', 'power_consumed', 'power_produced', 'tariff_indicator', 'voltage_l1', 'voltage_l2', 'voltage_l3',
+    'current_l1', 'current_l2', 'current_l3', 'energy_consumed_tariff1', 'energy_consumed_tariff2', 'energy_produced_tariff1', 'energy_produced_tariff2')
+# cumulative Wh counters grow beyond the 24 bits of a float, they are stored as doubles to keep every Wh
+COUNTER_FIELDS = frozenset(('importWh', 'exportWh', 'energy_consumed_tariff1', 'energy_consumed_tariff2', 'energy_produced_tariff1', 'energy_produced_tariff2'))
+
+class RingFile():
+    """Memory mapped file holding the last capacity samples of a fixed set of fields
+
+    A sample is a timestamp (double) followed by one float per field, or a
+    double for the energy counters, missing values are stored as NaN. The
+    header keeps the write position, once the file is full the oldest sample
+    is overwritten.
+    """
+    MAGIC = b'SESR'
+    VERSION = 2 # counters as doubles
+    HEADER = struct.Struct('<4sHHII')
+
+    def __init__(self, path, fields, capacity=DEFAULT_CAPACITY):
+        self.fields = tuple(fields)
+        self.record = struct.Struct('<d' + ''.join('d' if field in COUNTER_FIELDS else 'f' for field in self.fields))
+        self.capacity = capacity
+        size = self.HEADER.size + capacity * self.record.size
+        exists = os.path.exists(path) and os.path.getsize(path) == size
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        magic, version, numFields, fileCapacity, self.next = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC or version != self.VERSION or numFields != len(self.fields) or fileCapacity != capacity or self.next >= capacity:
+            # new file or a different layout, start over
+            self.map[:] = bytes(size)
+            self.next = 0
+            self.writeHeader()
+        # the file is full when the slot at the write position already holds a sample
+        self.count = self.capacity if self.record.unpack_from(self.map, self.offset(self.next))[0] > 0 else self.next
+
+    def writeHeader(self):
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, len(self.fields), self.capacity, self.next)
+
+    def offset(self, slot):
+        return self.HEADER.size + slot * self.record.size
+
+    def append(self, timestamp, values):
+        """store a sample, values maps field names to numbers (missing or None is stored as NaN)"""
+        row = [math.nan if values.get(field) is None else float(values[field]) for field in self.fields]
+        self.record.pack_into(self.map, self.offset(self.next), timestamp, *row)
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.capacity, self.count + 1)
+        self.writeHeader()
+
+    def timestampAt(self, index):
+        """timestamp of the sample at index, 0 being the oldest"""
+        return self.record.unpack_from(self.map, self.offset((self.next - self.count + index) % self.capacity))[0]
+
+    def bisect(self, timestamp):
+        """index of the first sample at or after timestamp"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestampAt(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, start=None, end=None):
+        """samples with start <= timestamp < end as (timestamp, {field: value}) tuples, oldest first"""
+        first = 0 if start is None else self.bisect(start)
+        last = self.count if end is None else self.bisect(end)
+        samples = []
+        for index in range(first, last):
+            row = self.record.unpack_from(self.map, self.offset((self.next - self.count + index) % self.capacity))
+            samples.append((row[0], {field: (None if math.isnan(value) else value) for field, value in zip(self.fields, row[1:])}))
+        return samples
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+class TelemetryRecorder():
+    """One ring file per device in folder, for battery snapshots and P1 details"""
+    def __init__(self, folder, capacity=DEFAULT_CAPACITY):
+        self.folder = folder
+        self.capacity = capacity
+        self.rings = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def ring(self, deviceId, fields):
+        """the ring file of a device, opened (or created) on first use"""
+        ring = self.rings.get(deviceId)
+        if ring is None:
+            ring = self.rings[deviceId] = RingFile(self.path(deviceId), fields, self.capacity)
+        return ring
+
+    def path(self, deviceId):
+        """file of a device: its readable name and a hash of the exact name, so "Sessy 1" and "Sessy_1" do not share a file"""
+        digest = hashlib.sha1(deviceId.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.folder, re.sub(r'[^A-Za-z0-9_.-]', '_', deviceId) + '-' + digest + '.ring')
+
+    def recordBattery(self, deviceId, snapshot, timestamp=None):
+        values = {field: getattr(snapshot, field) for field in BATTERY_FIELDS}
+        self.ring(deviceId, BATTERY_FIELDS).append(time.time() if timestamp is None else timestamp, values)
+
+    def recordP1(self, deviceId, data, timestamp=None):
+        values = {field: data.get(field) for field in P1_FIELDS if isinstance(data.get(field), (int, float))}
+        self.ring(deviceId, P1_FIELDS).append(time.time() if timestamp is None else timestamp, values)
+
+    def query(self, deviceId, start=None, end=None):
+        """recorded samples of a device between two epoch times, empty when nothing was recorded"""
+        ring = self.rings.get(deviceId)
+        return [] if ring is None else ring.query(start, end)
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
@@ -0,0 +1,124 @@
+"""Cache of the Sessy dynamic schedule"""
+import math
+from array import array
+from datetime import datetime, timedelta
+
+SLOT_SECONDS = 900 # the schedule is handled per quarter of an hour
+SLOTS_PER_DAY = 24 * 3600 // SLOT_SECONDS
+PUBLISH_HOUR = 13 # day ahead prices for tomorrow are published in the early afternoon
+REFRESH_RETRY = 3600 # seconds between fetches while waiting for (complete) schedule data
+PRICE_FACTOR = 100000 # Sessy reports prices as integer fractions of a euro per kWh
+
+class DaySchedule():
+    """Schedule of one day flattened into quarter-hour slots for O(1) lookups"""
+    __slots__ = ('date', 'prices', 'strategies')
+
+    def __init__(self, date):
+        self.date = date
+        self.prices = array('d', [math.nan] * SLOTS_PER_DAY)
+        self.strategies = [None] * SLOTS_PER_DAY
+
+    @staticmethod
+    def slotOf(moment):
+        return (moment.hour * 3600 + moment.minute * 60 + moment.second) // SLOT_SECONDS
+
+    def price(self, slot):
+        price = self.prices[slot]
+        return None if math.isnan(price) else price
+
+    def strategy(self, slot):
+        return self.strategies[slot]
+
+class ScheduleCache():
+    """Dynamic schedule of one battery, kept per date until the day has passed
+
+    The schedule is fetched when today is not known yet, or when tomorrow is
+    missing after the day ahead prices are normally published. In between
+    the cached slots answer all lookups.
+    """
+    def __init__(self):
+        self.days = {}
+        self.lastFetch = None
+
+    def needsRefresh(self, now):
+        if self.lastFetch is not None and (now - self.lastFetch).total_seconds() < REFRESH_RETRY:
+            return False
+        if now.date() not in self.days:
+            return True
+        return now.hour >= PUBLISH_HOUR and (now.date() + timedelta(days=1)) not in self.days
+
+    def markFetched(self, now):
+        """register a fetch attempt, successful or not, to space out the next one"""
+        self.lastFetch = now
+
+    def store(self, data, now):
+        """parse the schedule answer into day tables and drop the days that have passed"""
+        days = {}
+        for entry in data.get("energy_prices", []):
+            price = entry.get("price")
+            for moment in slotMoments(entry):
+                self.dayOf(days, moment).prices[DaySchedule.slotOf(moment)] = math.nan if price is None else price / PRICE_FACTOR
+        for entry in data.get("power_strategy", []):
+            for moment in slotMoments(entry):
+                self.dayOf(days, moment).strategies[DaySchedule.slotOf(moment)] = entry.get("strategy")
+        for date in [date for date in self.days if date < now.date()]:
+            del self.days[date]
+        self.days.update(days)
+
+    def checkpoint(self):
+        """the cached days to persist, the prices packed as doubles"""
+        return {"lastFetch": None if self.lastFetch is None else self.lastFetch.isoformat(),
+            "days": {date.isoformat(): {"prices": day.prices.tobytes(), "strategies": day.strategies} for date, day in self.days.items()}}
+
+    def restore(self, state, now):
+        """put back the persisted days from today on, incomplete days are left out"""
+        if state.get("lastFetch") is not None:
+            self.lastFetch = datetime.fromisoformat(state["lastFetch"])
+        for date, stored in state.get("days", {}).items():
+            day = DaySchedule(datetime.strptime(date, "%Y-%m-%d").date())
+            prices = array('d')
+            prices.frombytes(bytes(stored.get("prices", b"")))
+            strategies = list(stored.get("strategies", []))
+            if day.date < now.date() or len(prices) != SLOTS_PER_DAY or len(strategies) != SLOTS_PER_DAY:
+                continue
+            day.prices = prices
+            day.strategies = strategies
+            self.days[day.date] = day
+
+    def dayOf(self, days, moment):
+        day = days.get(moment.date())
+        if day is None:
+            day = days[moment.date()] = DaySchedule(moment.date())
+        return day
+
+    def priceAt(self, moment):
+        """energy price in euro per kWh for the quarter hour of moment, None when unknown"""
+        day = self.days.get(moment.date())
+        return None if day is None else day.price(DaySchedule.slotOf(moment))
+
+    def strategyAt(self, moment):
+        """scheduled strategy for the quarter hour of moment, None when unknown"""
+        day = self.days.get(moment.date())
+        return None if day is None else day.strategy(DaySchedule.slotOf(moment))
+
+    def cheapestFrom(self, moment):
+        """start time and price of the cheapest known quarter hour from moment on, None when unknown"""
+        best = None
+        for date in sorted(self.days):
+            if date < moment.date():
+                continue
+            day = self.days[date]
+            first = DaySchedule.slotOf(moment) if date == moment.date() else 0
+            for slot in range(first, SLOTS_PER_DAY):
+                price = day.price(slot)
+                if price is not None and (best is None or price < best[1]):
+                    best = (datetime.combine(date, datetime.min.time()) + timedelta(seconds=slot * SLOT_SECONDS), price)
+        return best
+
+def slotMoments(entry):
+    """local start times of the quarter hours covered by a schedule entry with epoch start and end times"""
+    if "start_time" not in entry:
+        return []
+    start = int(entry["start_time"])
+    end = int(entry.get("end_time", start + SLOT_SECONDS))
+    return [datetime.fromtimestamp(moment) for moment in range(start - start % SLOT_SECONDS, end, SLOT_SECONDS)]
@@ -0,0 +1,61 @@
+"""Sites: the batteries and P1 meters behind one grid connection"""
+from grid import SiteGrid
+
+SYSTEM_NAME = "Sessy system" # system device of a configuration without sites
+P1_NAME = "Sessy P1" # P1 device of a configuration without sites
+
+def siteConfigs(config, rejected=None):
+    """the sites of a configuration, one site with the top level devices when there is no "sites" list
+
+    a site whose system or P1 device id is already used by an earlier site is
+    left out, with rejected (a list) it is added there
+    """
+    if "sites" not in config:
+        return [{"name": "", "system_name": config.get("system_name", SYSTEM_NAME), "p1_name": config.get("p1_name", P1_NAME),
+            "p1meter": config.get("p1meter", []), "batteries": config.get("batteries", [])}]
+    sites = []
+    used = set()
+    for index, site in enumerate(config["sites"]):
+        name = site.get("name", "Site " + str(index + 1))
+        site = {"name": name, "system_name": site.get("system_name", name + " system"), "p1_name": site.get("p1_name", name + " P1"),
+            "p1meter": site.get("p1meter", []), "batteries": site.get("batteries", [])}
+        deviceIds = (site["system_name"], site["p1_name"])
+        if deviceIds[0] == deviceIds[1] or not used.isdisjoint(deviceIds):
+            if rejected is not None:
+                rejected.append(site)
+            continue
+        used.update(deviceIds)
+        sites.append(site)
+    return sites
+
+class Site():
+    """One installation: its batteries, its P1 meters and the devices that show their totals
+
+    The system device shows the totals of the batteries of the site and takes
+    the commands for all of them, the P1 device the sum of the meters of the
+    site. The control loop, when configured, keeps the grid power of the site
+    at its target.
+    """
+    def __init__(self, name, systemName, p1Name, controller=None):
+        self.name = name
+        self.systemName = systemName
+        self.p1Name = p1Name
+        self.controller = controller
+        self.batteries = [] # battery names, in the order of the configuration
+        self.grid = SiteGrid(())
+        self.gridPower = None
+        self.p1Data = None
+
+    def __repr__(self):
+        return "Site(" + self.systemName + ": " + ", ".join(self.batteries) + ")"
+
+    @property
+    def meters(self):
+        """the device ids of the P1 meters of the site"""
+        return list(self.grid.readings)
+
+    def updateGrid(self):
+        """recompute the site total of the P1 meters, returns it (None without readings)"""
+        self.p1Data = self.grid.aggregate()
+        self.gridPower = None if self.p1Data is None else self.p1Data.get("power_total")
+        return self.p1Data
@@ -0,0 +1,59 @@
+"""Compact records of the data read from a Sessy device"""
+
+class BatterySnapshot():
+    """Immutable record of everything read from one battery in a poll cycle
+
+    The power status, energy status and active strategy answers are folded
+    into one flat record so the previous cycle can be compared field by
+    field and only the changed values are sent to Domoticz.
+    """
+    __slots__ = ('stateOfCharge', 'power', 'powerSetpoint', 'systemState', 'systemStateDetails', 'strategyOverridden',
+        'importWh', 'exportWh', 'strategy',
+        'phase1Voltage', 'phase1Current', 'phase2Voltage', 'phase2Current', 'phase3Voltage', 'phase3Current')
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            object.__setattr__(self, field, values.get(field))
+
+    @classmethod
+    def fromResponses(cls, powerData, energyData, strategyData):
+        """build a snapshot from the json answers of the power, energy and strategy API"""
+        values = {}
+        sessy = powerData.get("sessy")
+        if sessy is not None:
+            values["stateOfCharge"] = sessy.get("state_of_charge")
+            values["power"] = sessy.get("power")
+            values["powerSetpoint"] = sessy.get("power_setpoint")
+            values["systemState"] = sessy.get("system_state")
+            values["systemStateDetails"] = sessy.get("system_state_details", "all ok")
+            values["strategyOverridden"] = sessy.get("strategy_overridden")
+        energy = energyData.get("sessy_energy")
+        if energy is not None:
+            values["importWh"] = energy.get("import_wh")
+            values["exportWh"] = energy.get("export_wh")
+        values["strategy"] = strategyData.get("strategy", "")
+        for phase in (1, 2, 3):
+            phaseData = powerData.get("renewable_energy_phase" + str(phase))
+            if phaseData is not None:
+                values["phase" + str(phase) + "Voltage"] = phaseData.get("voltage_rms")
+                values["phase" + str(phase) + "Current"] = phaseData.get("current_rms")
+        return cls(**values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BatterySnapshot is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, BatterySnapshot) and all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return "BatterySnapshot(" + ", ".join(field + "=" + repr(getattr(self, field)) for field in self.__slots__) + ")"
+
+    def checkpoint(self):
+        """the known fields to persist, BatterySnapshot(**state) restores the snapshot"""
+        return {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+
+    def changedFields(self, previous):
+        """names of the fields that differ from the previous snapshot, all fields when there is none"""
+        if previous is None:
+            return frozenset(self.__slots__)
+        return frozenset(field for field in self.__slots__ if getattr(self, field) != getattr(previous, field))
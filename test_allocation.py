@@ -0,0 +1,124 @@
+"""Tests of the distribution of a site setpoint over the batteries"""
+import random
+
+import pytest
+
+import allocation
+from allocation import AllocationEngine, BatteryAvailability, fillList, participants
+
+MIN_POWER = 100
+MAX_POWER = 2200
+
+def fleet(size, seed=1):
+    """size batteries with a spread of states of charge between 5% and 95%"""
+    rng = random.Random(seed)
+    return [BatteryAvailability("Sessy " + str(index + 1), round(rng.uniform(0.05, 0.95), 3)) for index in range(size)]
+
+@pytest.fixture(params=["list", "numpy"])
+def engine(request, monkeypatch):
+    """an engine that computes on plain lists or, when numpy is installed, on numpy arrays"""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(allocation, "NUMPY_MIN_BATTERIES", 1)
+    else:
+        monkeypatch.setattr(allocation, "numpy", None)
+    return AllocationEngine(MIN_POWER, MAX_POWER)
+
+@pytest.mark.parametrize("size", [30, 45, 60])
+@pytest.mark.parametrize("total", [25000, -25000])
+def test_allocate_large_fleet(engine, size, total):
+    batteries = fleet(size)
+    result = engine.allocate(total, batteries)
+    assert set(result.setpoints) == {battery.name for battery in batteries}
+    assert result.excluded == {}
+    assert abs(result.total - total) <= size # every setpoint is rounded to whole watts
+    for setpoint in result.setpoints.values():
+        assert setpoint == 0 or MIN_POWER <= abs(setpoint) <= MAX_POWER
+        assert setpoint * total >= 0
+
+@pytest.mark.parametrize("size", [30, 60])
+def test_allocate_follows_headroom(engine, size):
+    batteries = sorted(fleet(size, seed=size), key=lambda battery: battery.stateOfCharge)
+    charge = engine.allocate(20000, batteries)
+    discharge = engine.allocate(-20000, batteries)
+    charging = [charge.setpoints[battery.name] for battery in batteries]
+    discharging = [-discharge.setpoints[battery.name] for battery in batteries]
+    assert charging == sorted(charging, reverse=True) # emptiest batteries charge the most
+    assert discharging == sorted(discharging) # fullest batteries discharge the most
+
+def test_allocate_beyond_fleet_capacity(engine):
+    batteries = fleet(40)
+    result = engine.allocate(40 * MAX_POWER * 2, batteries)
+    assert all(setpoint == MAX_POWER for setpoint in result.setpoints.values())
+    assert result.total == 40 * MAX_POWER
+
+def test_allocate_clamps_to_min_power(engine):
+    batteries = fleet(30)
+    result = engine.allocate(350, batteries)
+    taking = [setpoint for setpoint in result.setpoints.values() if setpoint != 0]
+    assert len(taking) == 3 # as many batteries as can get minPower
+    assert all(setpoint >= MIN_POWER for setpoint in taking)
+    assert abs(sum(taking) - 350) <= 3
+
+@pytest.mark.parametrize("total", [0, 40, -40])
+def test_allocate_zero_or_too_small(engine, total):
+    batteries = fleet(30)
+    result = engine.allocate(total, batteries)
+    assert all(setpoint == 0 for setpoint in result.setpoints.values())
+    assert result.excluded == {}
+
+@pytest.mark.parametrize("total", [60, -60])
+def test_allocate_rounds_up_to_min_power(engine, total):
+    batteries = fleet(30)
+    result = engine.allocate(total, batteries)
+    taking = [setpoint for setpoint in result.setpoints.values() if setpoint != 0]
+    assert taking == [MIN_POWER if total > 0 else -MIN_POWER]
+
+def test_allocate_excludes_full_and_empty(engine):
+    batteries = fleet(30) + [BatteryAvailability("full", 0.995), BatteryAvailability("empty", 0.005)]
+    charge = engine.allocate(30000, batteries)
+    assert charge.excluded == {"full": "full"}
+    assert charge.setpoints["full"] == 0
+    assert charge.setpoints["empty"] > 0
+    discharge = engine.allocate(-30000, batteries)
+    assert discharge.excluded == {"empty": "empty"}
+    assert discharge.setpoints["empty"] == 0
+    assert discharge.setpoints["full"] < 0
+
+def test_allocate_excludes_unavailable(engine):
+    batteries = fleet(30) + [BatteryAvailability("stale", None, False, "stale"),
+        BatteryAvailability("overridden", 0.2, False, "strategy overridden"), BatteryAvailability("unread", None)]
+    result = engine.allocate(30000, batteries)
+    assert result.excluded == {"stale": "stale", "overridden": "strategy overridden", "unread": "no state of charge"}
+    for name in result.excluded:
+        assert result.setpoints[name] == 0
+    assert abs(result.total - 30000) <= 30
+
+def test_participants():
+    assert participants(1000, [0.5] * 30, MIN_POWER) == 10
+    assert participants(1000, [0.5] * 4, MIN_POWER) == 4 # no more than there are batteries
+    assert participants(1000, [0.5, 0.0, 0.0], MIN_POWER) == 1 # batteries without weight do not count
+    assert participants(50, [0.5] * 30, MIN_POWER) == 1 # minPower / 2 rounds up
+    assert participants(49, [0.5] * 30, MIN_POWER) == 0
+    assert participants(0, [0.5] * 30, MIN_POWER) == 0
+    assert participants(10, [0.5] * 30, 0) == 30
+
+def test_fill_list_clamps():
+    assert fillList(60, [0.2, 0.8], MIN_POWER, MAX_POWER) == [0.0, float(MIN_POWER)]
+    assert fillList(10000, [0.2, 0.8], MIN_POWER, MAX_POWER) == [float(MAX_POWER)] * 2
+    assert fillList(1000, [0.0, 0.0], MIN_POWER, MAX_POWER) == [0.0, 0.0]
+    shares = fillList(5000, [0.1, 0.3, 0.6], MIN_POWER, MAX_POWER)
+    assert sum(shares) == pytest.approx(5000)
+    assert shares[2] == pytest.approx(MAX_POWER) # capped, the rest is shared again
+    assert shares[1] == pytest.approx(3 * shares[0] - 2 * MIN_POWER)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_fill_array_matches_fill_list(seed):
+    numpy = pytest.importorskip("numpy")
+    rng = random.Random(seed)
+    size = rng.randint(1, 60)
+    weights = [0.0 if rng.random() < 0.1 else rng.random() for _ in range(size)]
+    amount = rng.uniform(0, size * MAX_POWER * 1.2)
+    expected = fillList(amount, weights, MIN_POWER, MAX_POWER)
+    actual = allocation.fillArray(amount, numpy.asarray(weights, dtype=float), MIN_POWER, MAX_POWER)
+    assert list(actual) == pytest.approx(expected, abs=1e-6)
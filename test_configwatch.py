@@ -0,0 +1,138 @@
+"""Tests of applying config.json changes while the plugin runs"""
+import json
+import os
+
+import pytest
+
+import fakeDomoticz
+import plugin
+from configwatch import ConfigWatcher, changedSections, deviceProblem, diffDevices
+
+def device(name, **settings):
+    config = {"name": name, "ip": "127.0.0.1:9", "user": "user", "pwd": "secret"} # nothing listens on port 9
+    config.update(settings)
+    return config
+
+class ConfigFile():
+    """config.json in a temporary folder, every save gets a newer modification time"""
+    def __init__(self, folder):
+        self.path = os.path.join(folder, "config.json")
+        self.saves = 0
+
+    def save(self, content):
+        with open(self.path, "w") as f:
+            f.write(content if isinstance(content, str) else json.dumps(content))
+        self.saves += 1
+        stamp = 1700000000 + self.saves
+        os.utime(self.path, (stamp, stamp))
+
+@pytest.fixture
+def configFile(tmp_path):
+    return ConfigFile(str(tmp_path))
+
+def test_watcher_changes(configFile):
+    configFile.save({"batteries": []})
+    watcher = ConfigWatcher(configFile.path)
+    assert watcher.load() == {"batteries": []}
+    assert watcher.changed() is None
+    configFile.save({"batteries": []}) # saved without changes
+    assert watcher.changed() is None
+    configFile.save({"batteries": [device("Sessy 1")]})
+    assert watcher.changed() == {"batteries": [device("Sessy 1")]}
+    configFile.save("{broken")
+    with pytest.raises(ValueError):
+        watcher.changed()
+    assert watcher.changed() is None # reported once
+    configFile.save({"batteries": []})
+    assert watcher.changed() == {"batteries": []}
+
+def test_diff_devices():
+    old = {"Sessy 1": device("Sessy 1"), "Sessy 2": device("Sessy 2")}
+    new = {"Sessy 1": device("Sessy 1", ip="10.0.0.1"), "Sessy 3": device("Sessy 3")}
+    assert diffDevices(old, new) == (["Sessy 3"], ["Sessy 2"], ["Sessy 1"])
+    assert diffDevices(old, dict(old)) == ([], [], [])
+
+def test_changed_sections():
+    assert changedSections({"batteries": [], "polling": {}}, {"batteries": [1], "polling": {"adaptive": False}, "metrics": {}}) == ["metrics", "polling"]
+
+@pytest.mark.parametrize("config, problem", [
+    (device("Sessy 1"), None),
+    (device("Sessy 1", timeout=2.5, pool_size=4, max_ages={"/api/v1/energy/status": 60}), None),
+    ({"name": "Sessy 1", "ip": "127.0.0.1"}, "'user' is missing or not a text"),
+    (device("Sessy 1", pwd=1234), "'pwd' is missing or not a text"),
+    ({"ip": "127.0.0.1", "user": "user", "pwd": "secret"}, "'name' is missing or not a text"),
+    (device("Sessy 1", timeout="fast"), "'timeout' has to be a positive number"),
+    (device("Sessy 1", pool_size=0), "'pool_size' has to be a positive number"),
+    (device("Sessy 1", max_ages=[60]), "'max_ages' has to be an object with a number per api"),
+    (device("Sessy 1", timeouts={"/api/v1/power/status": None}), "'timeouts /api/v1/power/status' has to be a positive number"),
+    ("Sessy 1", "a device has to be an object"),
+])
+def test_device_problem(config, problem):
+    assert deviceProblem(config) == problem
+
+@pytest.fixture
+def running(configFile, tmp_path, monkeypatch):
+    """a started plugin on a configuration with two batteries and a P1 meter"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(fakeDomoticz, "config", {})
+    monkeypatch.setitem(plugin.Parameters, "HomeFolder", str(tmp_path) + os.sep)
+    monkeypatch.setitem(plugin.Parameters, "Mode2", "6")
+    monkeypatch.setitem(plugin.Parameters, "Mode4", "Normal")
+    plugin.Devices.clear()
+    configFile.save({"p1meter": [device("P1 meter")], "batteries": [device("Sessy 1"), device("Sessy 2")]})
+    instance = plugin.SessyBatteryPlugin()
+    instance.onStart()
+    yield instance
+    instance.onStop()
+    plugin.Devices.clear()
+
+def test_reload_adds_and_removes(running, configFile):
+    configFile.save({"p1meter": [device("P1 meter")], "batteries": [device("Sessy 1"), device("Sessy 3")]})
+    running.checkConfig()
+    assert sorted(running.devices_dict) == ["Sessy 1", "Sessy 3"]
+    assert running.sites["Sessy system"].batteries == ["Sessy 1", "Sessy 3"]
+    assert sorted(running.appliedBatteries) == ["Sessy 1", "Sessy 3"]
+    assert "Sessy 3" in plugin.Devices
+
+def test_bad_reload_then_fixed(running, configFile, capsys):
+    first = running.devices_dict["Sessy 1"]
+    # Sessy 2 is removed, Sessy 3 has no credentials and Sessy 1 gets a broken address setting
+    configFile.save({"p1meter": [device("P1 meter")], "batteries": [device("Sessy 1", timeout=0), {"name": "Sessy 3", "ip": "127.0.0.1:9"}]})
+    running.checkConfig()
+    out = capsys.readouterr().out
+    assert "device 'Sessy 3' in config.json can not be used: 'user' is missing or not a text" in out
+    assert "device 'Sessy 1' in config.json can not be used" in out
+    assert sorted(running.devices_dict) == ["Sessy 1"] # the valid change is applied
+    assert running.devices_dict["Sessy 1"] is first # the invalid one keeps the previous configuration
+    assert running.appliedBatteries["Sessy 1"][1] == device("Sessy 1")
+    # the corrected file is applied against what is in use
+    configFile.save({"p1meter": [device("P1 meter")], "batteries": [device("Sessy 1", timeout=5), device("Sessy 3")]})
+    running.checkConfig()
+    assert sorted(running.devices_dict) == ["Sessy 1", "Sessy 3"]
+    assert running.devices_dict["Sessy 1"] is not first
+    assert running.devices_dict["Sessy 1"].timeout == 5
+    assert running.sites["Sessy system"].batteries == ["Sessy 1", "Sessy 3"]
+    assert "config.json: added Sessy 3" in capsys.readouterr().out
+
+def test_failed_setup_is_retried(running, configFile, monkeypatch, capsys):
+    original = running.createUnits
+    def failing(deviceId, specs):
+        if deviceId == "Sessy 3":
+            raise KeyError("unit table")
+        original(deviceId, specs)
+    monkeypatch.setattr(running, "createUnits", failing)
+    configFile.save({"p1meter": [device("P1 meter")], "batteries": [device("Sessy 1"), device("Sessy 2"), device("Sessy 3")]})
+    running.checkConfig()
+    assert "the battery 'Sessy 3' of config.json could not be set up" in capsys.readouterr().out
+    assert "Sessy 3" not in running.appliedBatteries
+    monkeypatch.setattr(running, "createUnits", original)
+    configFile.save({"p1meter": [device("P1 meter")], "batteries": [device("Sessy 1"), device("Sessy 2"), device("Sessy 3", pool_size=1)]})
+    running.checkConfig()
+    assert "Sessy 3" in running.appliedBatteries
+    assert running.sites["Sessy system"].batteries == ["Sessy 1", "Sessy 2", "Sessy 3"]
+
+def test_unreadable_devices_keep_configuration(running, configFile, capsys):
+    configFile.save({"p1meter": [device("P1 meter")], "batteries": [device("Sessy 1"), ["not", "a", "device"]]})
+    running.checkConfig()
+    assert "the devices in config.json can not be read, keeping the current configuration" in capsys.readouterr().out
+    assert sorted(running.devices_dict) == ["Sessy 1", "Sessy 2"]
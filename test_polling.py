@@ -0,0 +1,88 @@
+"""Tests of the polling helpers: retries, circuit breaker, poll plan and adaptive interval"""
+import pytest
+
+import polling
+from polling import AdaptiveInterval, DeviceHealth, PollPlan, BREAKER_OPEN_TIME, BREAKER_THRESHOLD, RETRY_BASE_DELAY
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(polling, "RETRY_JITTER", 0.0)
+    return Clock()
+
+def test_retry_backoff(clock):
+    health = DeviceHealth("Sessy 1", clock)
+    assert health.isDue() and not health.stale
+    assert not health.recordFailure("timeout")
+    assert health.stale and not health.isDue()
+    clock.now += RETRY_BASE_DELAY
+    assert health.retryDue()
+    health.recordFailure("timeout")
+    clock.now += RETRY_BASE_DELAY
+    assert not health.isDue() # the second delay is twice as long
+    clock.now += RETRY_BASE_DELAY
+    assert health.isDue()
+    assert health.recordSuccess()
+    assert not health.stale and not health.recordSuccess()
+
+def test_breaker_opens_and_probes(clock):
+    health = DeviceHealth("Sessy 1", clock)
+    opened = [health.recordFailure("timeout") for _ in range(BREAKER_THRESHOLD)]
+    assert opened == [False] * (BREAKER_THRESHOLD - 1) + [True]
+    assert health.state == DeviceHealth.OPEN
+    clock.now += BREAKER_OPEN_TIME - 1
+    assert not health.isDue()
+    clock.now += 1
+    assert health.isDue() and health.state == DeviceHealth.HALF_OPEN
+    assert health.recordFailure("timeout") # a failed probe opens the breaker again
+    clock.now += BREAKER_OPEN_TIME
+    assert health.isDue()
+    health.recordSuccess()
+    assert health.state == DeviceHealth.CLOSED
+
+def test_poll_plan_phases():
+    batteries = ["Sessy " + str(index) for index in range(1, 5)]
+    assert PollPlan().phases(batteries, 6) == {"Sessy 1": 0, "Sessy 2": 1, "Sessy 3": 3, "Sessy 4": 4}
+    assert set(PollPlan(stagger=False).phases(batteries, 6).values()) == {0}
+
+def test_poll_plan_requests():
+    plan = PollPlan()
+    plan.request(["Sessy 1"], ("strategy",))
+    plan.request(["Sessy 1"], ("energy",))
+    assert plan.refresh("Sessy 1") == frozenset(["strategy", "energy"])
+    assert plan.refresh("Sessy 1") == frozenset()
+
+def test_interval_follows_power():
+    interval = AdaptiveInterval(6, 3, 30)
+    assert interval.update(1000, 0) == 6 # nothing to compare with yet
+    assert interval.update(1050, 0) == 7 # below the threshold
+    assert interval.update(1200, 0) == 3 # power moved, halved down to the minimum
+    assert interval.update(1200, 0) == 4
+
+def test_interval_tariff_change():
+    interval = AdaptiveInterval(6, 3, 30)
+    assert [interval.update(1000, "1"), interval.update(1000, "2"), interval.update(1000, "1")] == [6, 3, 3]
+
+@pytest.mark.parametrize("old, new, changed", [
+    ((1000, "1"), (1000, "2"), True), # a state changes on any difference
+    ((1000, "1"), (1099, "1"), False),
+    ((1000, "1"), (900, "1"), True),
+    ((None, "1"), (5000, "1"), False), # unknown values are not compared
+    ((1000, True), (1000, False), True),
+])
+def test_interval_changed(old, new, changed):
+    assert AdaptiveInterval(6, 3, 30).changed(old, new) == changed
+
+def test_interval_fixed_and_bounds():
+    fixed = AdaptiveInterval(6, 3, 30, adaptive=False)
+    assert [fixed.update(0), fixed.update(5000)] == [6, 6]
+    bounded = AdaptiveInterval(6, 5, 7)
+    assert [bounded.update(0), bounded.update(0), bounded.update(0), bounded.update(5000)] == [6, 7, 7, 5]
+    bounded.tighten()
+    assert bounded.interval == 5
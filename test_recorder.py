@@ -0,0 +1,44 @@
+"""Tests of the telemetry ring files"""
+import os
+
+from recorder import RingFile, TelemetryRecorder, BATTERY_FIELDS, P1_FIELDS
+
+def test_ring_query_and_wrap(tmp_path):
+    ring = RingFile(str(tmp_path / "a.ring"), ("power",), capacity=4)
+    for second in range(1, 7):
+        ring.append(float(second), {"power": second * 100})
+    assert [sample[0] for sample in ring.query()] == [3.0, 4.0, 5.0, 6.0] # the oldest were overwritten
+    assert ring.query(4.0, 6.0) == [(4.0, {"power": 400.0}), (5.0, {"power": 500.0})]
+    ring.append(7.0, {})
+    assert ring.query(7.0) == [(7.0, {"power": None})]
+    ring.close()
+
+def test_ring_reopen(tmp_path):
+    path = str(tmp_path / "a.ring")
+    ring = RingFile(path, ("power",), capacity=4)
+    ring.append(1.0, {"power": 100})
+    ring.close()
+    ring = RingFile(path, ("power",), capacity=4)
+    assert ring.query() == [(1.0, {"power": 100.0})]
+    ring.close()
+    ring = RingFile(path, ("power", "stateOfCharge"), capacity=4) # a different layout starts over
+    assert ring.query() == []
+    ring.close()
+
+def test_counters_keep_every_wh(tmp_path):
+    recorder = TelemetryRecorder(str(tmp_path))
+    counter = 123456789 # far beyond the 16777216 a float holds exactly
+    recorder.recordP1("Sessy P1", {"energy_consumed_tariff1": counter, "power_total": 1234})
+    sample = recorder.query("Sessy P1")[0][1]
+    assert sample["energy_consumed_tariff1"] == counter
+    assert sample["power_total"] == 1234
+    recorder.close()
+
+def test_file_names_do_not_collide(tmp_path):
+    recorder = TelemetryRecorder(str(tmp_path))
+    recorder.ring("Sessy 1", BATTERY_FIELDS)
+    recorder.ring("Sessy_1", P1_FIELDS)
+    assert recorder.path("Sessy 1") != recorder.path("Sessy_1")
+    assert os.path.basename(recorder.path("Sessy 1")).startswith("Sessy_1-")
+    assert len(os.listdir(str(tmp_path))) == 2
+    recorder.close()
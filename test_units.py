@@ -0,0 +1,104 @@
+"""Tests of the unit tables and the sensors added in config.json"""
+import pytest
+
+import plugin
+from units import customSpec, UnitSpec
+
+@pytest.fixture
+def sessy():
+    """a plugin with all optional features off, as before onStart reads the configuration"""
+    instance = plugin.SessyBatteryPlugin()
+    instance.metricsUnits = False
+    instance.controlEnabled = False
+    return instance
+
+def units(table):
+    return [spec.unit for spec in table]
+
+def test_custom_spec_scales_numbers():
+    spec = customSpec({"unit": 40, "name": "Gas", "path": "gas_meter_value", "scale": 1000, "digits": 3, "label": "m3"})
+    assert spec.arguments == {"TypeName": "Custom"}
+    assert spec.options == {"Custom": "1;m3"}
+    assert spec.reading({"gas_meter_value": 1234567}) == (0, "1234.567")
+    assert spec.reading({}) is None
+
+def test_custom_spec_shows_states_as_text():
+    spec = customSpec({"unit": 50, "name": "State", "path": "state"})
+    assert spec.reading({"state": "P1_OK"}) == (0, "P1_OK") # a text field on a custom sensor does not raise
+    assert spec.reading({"state": True}) == (0, "True")
+    spec = customSpec({"unit": 50, "name": "State", "path": "state", "type": "text"})
+    assert spec.arguments == {"TypeName": "Text"}
+    assert spec.reading({"state": "P1_OK"}) == (0, "P1_OK")
+
+def test_custom_spec_nested_path():
+    spec = customSpec({"unit": 41, "name": "Frequency", "path": "sessy.frequency", "scale": 1000, "digits": 2})
+    assert spec.reading({"sessy": {"frequency": 50012}}) == (0, "50.01")
+    assert spec.fields == frozenset(["sessy"])
+
+@pytest.mark.parametrize("config", [
+    {"unit": 40, "name": "x"},
+    {"unit": "forty", "name": "x", "path": "power"},
+    {"unit": 40, "name": "x", "path": 5},
+    {"unit": 40, "name": "x", "path": ""},
+    {"unit": 40, "name": "x", "path": "power", "scale": 0},
+    {"unit": 40, "name": "x", "path": "power", "scale": "big"},
+    {"unit": 40, "name": "x", "path": "power", "type": "gauge"},
+])
+def test_custom_spec_invalid(config):
+    with pytest.raises((KeyError, ValueError, TypeError)):
+        customSpec(config)
+
+def test_affected_by():
+    spec = UnitSpec(1, "Power", ("power", "importWh"))
+    assert spec.affectedBy(None)
+    assert spec.affectedBy(frozenset(["importWh"]))
+    assert not spec.affectedBy(frozenset(["stateOfCharge"]))
+    assert UnitSpec(2, "Computed", lambda record: record).affectedBy(frozenset())
+
+def test_unit_table_defaults(sessy):
+    assert units(sessy.unitTable("battery", sessy.batteryUnits, {})) == units(sessy.batteryUnits)
+    system = units(sessy.unitTable("system", sessy.systemUnits, {}))
+    for unit in (sessy.batHeartbeatTimeUnit, sessy.batDumpStatsUnit, sessy.batControlUnit):
+        assert unit not in system
+
+def test_unit_table_optional_units(sessy):
+    sessy.metricsUnits = True
+    sessy.controlEnabled = True
+    system = units(sessy.unitTable("system", sessy.systemUnits, {}))
+    for unit in (sessy.batHeartbeatTimeUnit, sessy.batDumpStatsUnit, sessy.batControlUnit):
+        assert unit in system
+
+def test_unit_table_disabled(sessy, capsys):
+    table = sessy.unitTable("battery", sessy.batteryUnits, {"battery": {"disabled": [sessy.batPhase1CurrentUnit, sessy.batErrorWarning]}})
+    assert sessy.batPhase1CurrentUnit not in units(table)
+    assert sessy.batErrorWarning in units(table) # shows no polled data, it is kept and reported
+    assert "can not be disabled" in capsys.readouterr().out
+
+def test_unit_table_disabled_optional_unit(sessy, capsys):
+    # units of features that are off are left out without complaint, even when listed as disabled
+    table = sessy.unitTable("system", sessy.systemUnits, {"system": {"disabled": [sessy.batHeartbeatTimeUnit, sessy.batControlUnit]}})
+    assert sessy.batHeartbeatTimeUnit not in units(table)
+    assert sessy.batControlUnit not in units(table)
+    assert "can not be disabled" not in capsys.readouterr().out
+
+def test_unit_table_custom(sessy, capsys):
+    config = {"battery": {"custom": [
+        {"unit": 40, "name": "Setpoint", "path": "powerSetpoint"},
+        {"unit": 41, "name": "Frequency", "path": "sessy.frequency"}, # the answer, not a field of the snapshot
+        {"unit": 42, "name": "State", "path": "systemState", "type": "text"},
+        {"unit": sessy.batPowerUnit, "name": "Taken", "path": "power"},
+        {"unit": 300, "name": "Out of range", "path": "power"},
+        {"unit": 43, "name": "Broken", "path": "power", "scale": 0},
+    ]}}
+    table = sessy.unitTable("battery", sessy.batteryUnits, config, plugin.BatterySnapshot.__slots__)
+    assert units(table)[len(sessy.batteryUnits):] == [40, 42]
+    out = capsys.readouterr().out
+    assert "'sessy.frequency' is not one of" in out
+    assert "already in use or out of range" in out
+    assert "invalid custom unit" in out
+
+def test_unit_table_custom_p1(sessy):
+    config = {"p1meter": {"custom": [{"unit": 50, "name": "State", "path": "state"}, {"unit": 51, "name": "Gas", "path": "gas.value"}]}}
+    table = sessy.unitTable("p1meter", sessy.p1Units, config)
+    assert units(table)[-2:] == [50, 51]
+    assert table[-2].reading({"state": "P1_OK"}) == (0, "P1_OK")
@@ -0,0 +1,39 @@
+"""Non-blocking transport for the Sessy API calls"""
+import queue
+
+class EventTransport():
+    """Runs API calls on a worker pool and hands the answers back as messages
+
+    send() only schedules a call, the worker thread puts the finished call on
+    a queue and the plugin thread picks it up with receive() to run its
+    handler, much like Domoticz delivers onMessage callbacks. A device that
+    still has a call in flight is not sent a second one.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.messages = queue.SimpleQueue()
+        self.inFlight = set()
+
+    def busy(self, key):
+        return key in self.inFlight
+
+    def send(self, key, handler, call, *args):
+        """schedule call(*args), handler gets its future once it is received; False when key is still busy"""
+        if key in self.inFlight:
+            return False
+        self.inFlight.add(key)
+        future = self.pool.submit(call, *args)
+        future.add_done_callback(lambda future: self.messages.put((key, handler, future)))
+        return True
+
+    def receive(self, wait=False):
+        """the finished calls as (key, handler, future), with wait until nothing is in flight anymore"""
+        received = []
+        while len(self.inFlight) > 0:
+            try:
+                message = self.messages.get(block=wait)
+            except queue.Empty:
+                break
+            self.inFlight.discard(message[0])
+            received.append(message)
+        return received
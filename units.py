@@ -0,0 +1,105 @@
+"""Descriptions of the Domoticz units created by the plugin
+
+Every unit is described once by a UnitSpec: how it is created and, for the
+units that show polled data, where its value comes from and how it is
+formatted. The plugin creates and updates its units by looping over these
+tables.
+"""
+
+def compilePath(path):
+    """accessor for a dotted path into a json answer (dict keys) or a record (attributes), a callable is used as is"""
+    if callable(path):
+        return path
+    parts = path.split(".")
+    if len(parts) == 1:
+        name = parts[0]
+        return lambda record: record.get(name) if isinstance(record, dict) else getattr(record, name, None)
+    def read(record):
+        for part in parts:
+            if record is None:
+                return None
+            record = record.get(part) if isinstance(record, dict) else getattr(record, part, None)
+        return record
+    return read
+
+def text(value):
+    return 0, str(value)
+
+def state(value):
+    return 1, str(value)
+
+def scaled(factor=1, digits=1):
+    """value divided by factor and rounded, e.g. mV to V"""
+    return lambda value: (0, str(round(value / factor, digits)))
+
+def numberOrText(factor=1, digits=1):
+    """numbers scaled like scaled(), other values (states, flags) shown as text"""
+    number = scaled(factor, digits)
+    return lambda value: number(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else text(value)
+
+class UnitSpec():
+    """One unit of a device: its number, the name after the device name and the Domoticz type arguments
+
+    options may be a function of the plugin and the device id for options that
+    depend on the configuration, enabled the name of a plugin attribute that has to be true
+    for the unit to be created. Units showing polled data have a source: a
+    dotted path, a tuple of paths or a function of the polled record. value
+    turns the source values into the (nValue, sValue) to show, the unit is
+    not updated while one of them is missing.
+    """
+    __slots__ = ('unit', 'name', 'arguments', 'options', 'enabled', 'source', 'value', 'fields', 'readers')
+
+    def __init__(self, unit, name, source=None, value=text, options=None, enabled=None, **arguments):
+        self.unit = unit
+        self.name = name
+        self.options = options
+        self.enabled = enabled
+        self.arguments = arguments
+        self.source = source
+        self.value = value
+        paths = source if isinstance(source, tuple) else (source,)
+        self.readers = tuple(compilePath(path) for path in paths) if source is not None else ()
+        # the record fields the unit depends on, None when the source is a function
+        self.fields = None if source is None or any(callable(path) for path in paths) else frozenset(path.split(".")[0] for path in paths)
+
+    def wanted(self, plugin):
+        return self.enabled is None or bool(getattr(plugin, self.enabled, False))
+
+    def unitArguments(self, plugin, deviceId):
+        """keyword arguments of Domoticz.Unit for this unit on a device"""
+        arguments = dict(self.arguments, Name=deviceId + ' - ' + self.name, Unit=self.unit, DeviceID=deviceId)
+        options = self.options(plugin, deviceId) if callable(self.options) else self.options
+        if options is not None:
+            arguments["Options"] = options
+        return arguments
+
+    def affectedBy(self, changed):
+        """does a change of these record fields (None: unknown) change the unit"""
+        return changed is None or self.fields is None or not self.fields.isdisjoint(changed)
+
+    def reading(self, record):
+        """(nValue, sValue) to show for a polled record, None when the source is missing"""
+        values = [read(record) for read in self.readers]
+        if any(value is None for value in values):
+            return None
+        return self.value(*values)
+
+def customSpec(config):
+    """a sensor added in config.json: {"unit", "name", "path", "scale", "digits", "label", "type"}
+
+    the default type "custom" makes a Custom sensor for numbers, "text" a Text sensor for states;
+    raises KeyError, ValueError or TypeError for an invalid configuration
+    """
+    if not isinstance(config["path"], str) or config["path"] == "":
+        raise ValueError("path has to be a field name")
+    kind = config.get("type", "custom")
+    if kind == "text":
+        return UnitSpec(int(config["unit"]), str(config["name"]), source=config["path"], value=text, TypeName="Text")
+    if kind != "custom":
+        raise ValueError("type has to be 'custom' or 'text'")
+    scale = float(config.get("scale", 1))
+    if scale == 0:
+        raise ValueError("scale can not be 0")
+    return UnitSpec(int(config["unit"]), str(config["name"]), source=config["path"],
+        value=numberOrText(scale, int(config.get("digits", 1))),
+        options={'Custom': '1;' + str(config.get("label", ""))}, TypeName="Custom")